@@ -0,0 +1,506 @@
+#!/usr/bin/env python3
+
+import os
+import io
+import gzip
+import zlib
+import struct
+import tarfile
+import zipfile
+from collections import OrderedDict
+from parsing import read_alpino, visit_sentence
+from utils import get_sentences
+
+#---------------------------------------------------#
+#   Alpino output storage.                          #
+#                                                   #
+#   The Alpino output of a dataset holds one        #
+#   directory per text with one *.xml file per      #
+#   sentence. Instead of a directory, it can also   #
+#   be stored in a single tar or zip archive or in  #
+#   an Alpino compact corpus (*.index and           #
+#   *.data.dz), which are read without extracting.  #
+#                                                   #
+#---------------------------------------------------#
+
+class DirectoryStore:
+    '''
+    Alpino output of a dataset stored as directories.
+
+    root = directory with one `text_{n}.txt` directory per text
+    '''
+
+    def __init__(self, root):
+        self.root = root
+
+    def texts(self):
+        return [f for f in os.listdir(self.root) if f.endswith('.txt')]
+
+    def sentences(self, text):
+        return get_sentences(f'{self.root}/{text}')
+
+    def read(self, text, sentence):
+        return f'{self.root}/{text}/{sentence}'
+
+
+class MemberStore:
+    '''
+    Base class of the stores that keep the Alpino output of a dataset in a
+    single file.
+
+    path = the file
+    dataset = name of the dataset, the directory its texts are stored under
+    strict = if True, only the members under a `dataset` directory are read,
+             for files that hold the Alpino output of several datasets;
+             otherwise those members are preferred if there are any, and all
+             members are read if there are none
+
+    Every *.xml member is indexed by its last two path components, the
+    text directory and the sentence file name. Raises ValueError if two
+    read members have the same text directory and sentence file name.
+    '''
+
+    def __init__(self, path, dataset = None, strict = False):
+        self.path = path
+        self.dataset = dataset
+        self.strict = strict
+        self.members = {}
+        self._others = {}
+        self._file = None
+        self._pid = None
+
+    def _parts(self, name):
+        '''
+        Returns tuple -> (in dataset, text directory, sentence file name) of
+        a member, or None if it is not a sentence.
+        '''
+        parts = name.replace('\\', '/').split('/')
+
+        if len(parts) < 2 or not parts[-1].endswith('.xml'):
+            return None
+
+        return len(parts) >= 3 and parts[-3] == self.dataset, parts[-2], parts[-1]
+
+    def wanted(self, name):
+        '''
+        Returns bool -> whether the member has to be added, so that members
+        that are not kept are not read.
+        '''
+        parts = self._parts(name)
+
+        if parts is None:
+            return False
+
+        in_dataset = parts[0]
+        return in_dataset or not (self.strict or self.members)
+
+    def add(self, name, locator):
+        if not self.wanted(name):
+            return
+
+        in_dataset, text, sentence = self._parts(name)
+
+        if in_dataset and not self.members:
+            # The members outside the dataset directory are no longer needed
+            self._others = {}
+
+        sentences = (self.members if in_dataset else self._others).setdefault(text, {})
+
+        if sentence in sentences:
+            raise ValueError(f'{self.path} holds more than one {text}/{sentence}; store the Alpino output of every dataset under its own directory')
+
+        sentences[sentence] = locator
+
+    def finish(self):
+        '''
+        Ends the indexing: falls back to the members outside the dataset
+        directory if there are none under it.
+        '''
+        if not self.members and not self.strict:
+            self.members = self._others
+
+        self._others = None
+
+    def file(self):
+        '''
+        Returns the store's open file, opened again in every new process so
+        that forked processes do not share its position.
+        '''
+        if self._file is None or self._pid != os.getpid():
+            self._file = self.open()
+            self._pid = os.getpid()
+
+        return self._file
+
+    def texts(self):
+        return [text for text in self.members if text.endswith('.txt')]
+
+    def sentences(self, text):
+        '''
+        Returns a list with the sentences' file names, sorted like
+        `utils.get_sentences`.
+        '''
+        if text not in self.members:
+            raise FileNotFoundError(f'{text} not found in {self.path}')
+
+        return sorted(self.members[text])
+
+    def read(self, text, sentence):
+        '''
+        Returns bytes -> the content of the sentence's *.xml file.
+        '''
+        return self.read_member(self.members[text][sentence])
+
+
+class TarStore(MemberStore):
+    '''
+    Alpino output of a dataset stored in a tar archive, compressed or not.
+
+    The archive is read once, sequentially, to index its members. The
+    members of an uncompressed archive are read from it when needed; the
+    members of a compressed one are kept in memory while it is read, since
+    it cannot be read out of order efficiently.
+    '''
+
+    def __init__(self, path, dataset = None, strict = False):
+        super().__init__(path, dataset, strict)
+
+        with tarfile.open(path, 'r:*') as archive:
+            compressed = not isinstance(archive.fileobj, io.BufferedReader)
+
+            for member in archive:
+                if not member.isfile() or not self.wanted(member.name):
+                    continue
+
+                if compressed:
+                    self.add(member.name, archive.extractfile(member).read())
+                else:
+                    self.add(member.name, (member.offset_data, member.size))
+
+        self.finish()
+
+    def open(self):
+        return open(self.path, 'rb')
+
+    def read_member(self, locator):
+        if isinstance(locator, bytes):
+            return locator
+
+        offset, size = locator
+        f = self.file()
+        f.seek(offset)
+        return f.read(size)
+
+
+class ZipStore(MemberStore):
+    '''
+    Alpino output of a dataset stored in a zip archive, indexed from its
+    central directory and read one member at a time.
+    '''
+
+    def __init__(self, path, dataset = None, strict = False):
+        super().__init__(path, dataset, strict)
+
+        with zipfile.ZipFile(path) as archive:
+            for name in archive.namelist():
+                self.add(name, name)
+
+        self.finish()
+
+    def open(self):
+        return zipfile.ZipFile(self.path)
+
+    def read_member(self, name):
+        return self.file().read(name)
+
+
+# Digits of the base64 numbers of an Alpino compact corpus index
+_base64_digits = {c: i for i, c in enumerate('ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/')}
+
+def decode_base64_number(value):
+    '''
+    Returns int -> the number written in base 64, most significant digit
+    first, as used for offsets and sizes in Alpino compact corpus indices.
+    '''
+    number = 0
+
+    for c in value:
+        number = number * 64 + _base64_digits[c]
+
+    return number
+
+class DictzipReader:
+    '''
+    Random access to the uncompressed content of a dictzip file.
+
+    A dictzip file is a gzip file compressed in chunks of a fixed size,
+    whose compressed sizes are listed in the 'RA' extra field of its
+    header, so that any chunk can be decompressed on its own.
+
+    Files without the 'RA' field are decompressed as a whole once.
+    '''
+
+    def __init__(self, path):
+        self.path = path
+        self.data = None
+
+        with open(path, 'rb') as f:
+            header = f.read(10)
+
+            if header[:2] != b'\x1f\x8b':
+                raise ValueError(f'{path} is not a gzip file')
+
+            flags = header[3]
+            chunks = None
+
+            if flags & 4:
+                extra_length, = struct.unpack('<H', f.read(2))
+                extra = f.read(extra_length)
+                chunks = self._chunks(extra)
+
+            # Skip the file name, comment and header checksum
+            for flag in (8, 16):
+                if flags & flag:
+                    while f.read(1) not in (b'\x00', b''):
+                        pass
+
+            if flags & 2:
+                f.read(2)
+
+            start = f.tell()
+
+        if chunks is None:
+            with gzip.open(path, 'rb') as f:
+                self.data = f.read()
+            return
+
+        self.chunk_length, sizes = chunks
+        self.offsets = [start]
+
+        for size in sizes:
+            self.offsets.append(self.offsets[-1] + size)
+
+        self._file = None
+        self._pid = None
+
+    @staticmethod
+    def _chunks(extra):
+        '''
+        Returns tuple -> (uncompressed chunk length, compressed chunk sizes)
+        from the 'RA' subfield of the gzip extra field, or None.
+        '''
+        i = 0
+
+        while i + 4 <= len(extra):
+            subfield = extra[i:i + 2]
+            length, = struct.unpack('<H', extra[i + 2:i + 4])
+            data = extra[i + 4:i + 4 + length]
+
+            if subfield == b'RA':
+                version, chunk_length, chunk_count = struct.unpack('<HHH', data[:6])
+                sizes = struct.unpack(f'<{chunk_count}H', data[6:6 + 2 * chunk_count])
+                return chunk_length, sizes
+
+            i += 4 + length
+
+        return None
+
+    def read(self, offset, size):
+        '''
+        Returns bytes -> `size` bytes of the uncompressed content, starting
+        at `offset`.
+        '''
+        if self.data is not None:
+            return self.data[offset:offset + size]
+
+        if self._file is None or self._pid != os.getpid():
+            self._file = open(self.path, 'rb')
+            self._pid = os.getpid()
+
+        first = offset // self.chunk_length
+        last = (offset + size - 1) // self.chunk_length if size else first
+
+        self._file.seek(self.offsets[first])
+        compressed = self._file.read(self.offsets[last + 1] - self.offsets[first])
+
+        # Every chunk ends with a full flush, so they decompress as one stream
+        content = zlib.decompressobj(-zlib.MAX_WBITS).decompress(compressed)
+
+        start = offset - first * self.chunk_length
+        return content[start:start + size]
+
+
+class CompactStore(MemberStore):
+    '''
+    Alpino output of a dataset stored as an Alpino compact corpus:
+    `{name}.index` lists every member with the base64 offset and size of
+    its content in the dictzip file `{name}.data.dz`.
+
+    path = corpus path without the .index / .data.dz extension
+    '''
+
+    def __init__(self, path, dataset = None, strict = False):
+        super().__init__(path, dataset, strict)
+        self.data = DictzipReader(f'{path}.data.dz')
+
+        with open(f'{path}.index', encoding = 'utf-8') as f:
+            for line in f:
+                line = line.rstrip('\n')
+
+                if not line:
+                    continue
+
+                name, offset, size = line.rsplit('\t', 2)
+                self.add(name, (decode_base64_number(offset), decode_base64_number(size)))
+
+        self.finish()
+
+    def read_member(self, locator):
+        return self.data.read(*locator)
+
+
+# File extensions of the single-file stores, in the order they are looked for
+store_types = [
+    ('.tar', TarStore),
+    ('.tar.gz', TarStore),
+    ('.tgz', TarStore),
+    ('.tar.bz2', TarStore),
+    ('.tar.xz', TarStore),
+    ('.zip', ZipStore),
+    ('.index', CompactStore),
+    ]
+
+def open_single_file_store(path, dataset, strict):
+    '''
+    Returns the store of the first of `path` + each extension in
+    `store_types` that exists, or None if none exists.
+    '''
+    for extension, store_type in store_types:
+        if os.path.exists(path + extension):
+            if store_type is CompactStore:
+                return CompactStore(path, dataset, strict)
+            return store_type(path + extension, dataset, strict)
+
+    return None
+
+def open_store(root):
+    '''
+    root = path of the Alpino output of a dataset, without extension
+
+    e.g. './alpino_output/{filename}'
+
+    Returns the store of the Alpino output, the first that exists of:
+        - the directory `root`
+        - a file `root` + an extension in `store_types`, holding the
+          Alpino output of this dataset
+        - a file with the path of the parent directory of `root` + an
+          extension in `store_types`, e.g. './alpino_output.tar', holding
+          the Alpino output of one or more datasets, each under its own
+          directory
+    '''
+    if os.path.isdir(root):
+        return DirectoryStore(root)
+
+    parent, dataset = os.path.split(os.path.normpath(root))
+
+    store = open_single_file_store(root, dataset, strict = False)
+
+    if store is None and parent:
+        store = open_single_file_store(parent, dataset, strict = True)
+
+    if store is None or not store.members:
+        raise FileNotFoundError(f'No Alpino output found at {root}')
+
+    return store
+
+
+stores = {}
+
+def get_store(root):
+    '''
+    Returns the store of the Alpino output in `root`, opened once per process,
+    see `open_store`.
+    '''
+    if root not in stores:
+        stores[root] = open_store(root)
+    return stores[root]
+
+#---------------------------------------------------#
+#   Sentence record cache.                          #
+#                                                   #
+#   Keeps the sentence records of the most recently #
+#   used texts in memory so that every *.xml file   #
+#   is only read, parsed and walked once per run.   #
+#                                                   #
+#---------------------------------------------------#
+
+class SentenceCache:
+    '''
+    LRU cache of the records of parsed Alpino sentences, grouped per text.
+
+    max_sentences = maximum number of sentence records kept in memory.
+
+    When the bound is exceeded, the least recently used texts are evicted
+    as a whole. The text that was just requested is never evicted, even if
+    it is larger than the bound on its own.
+    '''
+
+    def __init__(self, max_sentences = 2000):
+        self.max_sentences = max_sentences
+        self.n_sentences = 0
+        self._texts = OrderedDict()
+
+    def __contains__(self, path):
+        return path in self._texts
+
+    def __len__(self):
+        return len(self._texts)
+
+    def get(self, path):
+        '''
+        path = text directory location
+
+        e.g. './output/text_{n}.txt'
+
+        The text is looked up in the store of its parent directory, so it
+        can also be read from an archive or compact corpus, see `open_store`.
+
+        Returns list of tuples -> (file name, SentenceRecord) for every sentence
+        of the text, in the order given by `get_sentences`.
+
+        Each file is read once by `read_alpino` and walked once by
+        `visit_sentence`; the tree itself is not kept.
+        '''
+        if path in self._texts:
+            self._texts.move_to_end(path)
+            return self._texts[path]
+
+        root, text = os.path.split(path)
+        store = get_store(root)
+
+        records = [(sentence, visit_sentence(read_alpino(store.read(text, sentence)))) for sentence in store.sentences(text)]
+
+        self._texts[path] = records
+        self.n_sentences += len(records)
+        self._evict()
+
+        return records
+
+    def _evict(self):
+        while self.n_sentences > self.max_sentences and len(self._texts) > 1:
+            _, records = self._texts.popitem(last = False)
+            self.n_sentences -= len(records)
+
+    def clear(self):
+        self._texts.clear()
+        self.n_sentences = 0
+
+
+sentence_cache = SentenceCache()
+
+def get_records(path):
+    '''
+    Returns the sentence records of the text in `path` through the shared
+    sentence cache. See `SentenceCache.get`.
+    '''
+    return sentence_cache.get(path)
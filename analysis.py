@@ -3,9 +3,75 @@
 import os
 import sys
 import pandas as pd
+from functools import partial
+from multiprocessing import Pool
 from features import *
+from alpino import get_store
+from ted import backends, set_backend, ted_modes, set_mode, ted_memo
+from utils import pop_option
 
-USAGE = f"Usage: python {sys.argv[0]} [--help | -h] | [<preprocessed dataset.csv filename> <new dataset label>]"
+USAGE = f"Usage: python {sys.argv[0]} [--help | -h] | [<preprocessed dataset.csv filename> <new dataset label> [--workers N] [--ted-backend apted|numpy] [--ted-mode exact|approximate] [--ted-budget N] [--ted-memo path] [--tscan-dtype float32|float64]]"
+
+def configure_ted(ted_backend = 'apted', ted_mode = 'exact', ted_budget = None, ted_memo_path = None):
+    '''
+    Sets the TED backend, mode and budget of the current process and loads
+    the distances saved in `ted_memo_path` into its TED memo.
+    '''
+    set_backend(ted_backend)
+    set_mode(ted_mode, ted_budget)
+
+    if ted_memo_path is not None:
+        ted_memo.load(ted_memo_path)
+
+def init_worker(corpus, ted_settings = ()):
+    '''
+    Sets the corpus and TED settings of a pool worker, which records its
+    new TED memo entries for `extract_text_indices`.
+    '''
+    set_corpus(corpus)
+    configure_ted(*ted_settings)
+    ted_memo.record_updates = True
+
+def extract_text_indices(n, selected = None):
+    '''
+    Returns tuple -> (`get_text_indices` of text n, TED memo updates), so
+    that pool workers can report the distances they computed.
+    '''
+    return get_text_indices(n, selected = selected, bulk = True), ted_memo.take_updates()
+
+def extract_indices(text_ns, workers = 1, ted_settings = (), selected = None):
+    '''
+    Extracts every index of every text, see `get_text_indices`, except the
+    ones that `apply_text_indices` looks up for all texts at once.
+
+    Texts are independent from each other, so if more than one worker is
+    requested they are spread over a pool of `workers` processes. The TED
+    memo updates of the workers are merged into the memo of this process.
+    The Alpino output is indexed before the pool is started, so that forked
+    workers share the index, see `alpino.get_store`.
+
+    ted_settings = arguments for `configure_ted`
+    selected = list of indices to extract, defaults to `indices`
+
+    Texts are taken from the corpus set with `set_corpus`.
+
+    Returns list with the extracted values in the same order as `text_ns`.
+    '''
+
+    configure_ted(*ted_settings)
+
+    if workers == 1:
+        return [get_text_indices(n, selected = selected, bulk = True) for n in text_ns]
+
+    get_store(get_corpus().output_path)
+
+    with Pool(workers, initializer = init_worker, initargs = (get_corpus(), ted_settings)) as pool:
+        results = pool.map(partial(extract_text_indices, selected = selected), text_ns, chunksize = 1)
+
+    for values, updates in results:
+        ted_memo.merge(updates)
+
+    return [values for values, updates in results]
 
 def main():
 
@@ -13,6 +79,33 @@ def main():
     #   Read command line arguments                     #
     #---------------------------------------------------#
 
+    workers = pop_option(sys.argv, '--workers', default = 1, cast = int)
+
+    if workers < 1:
+        print('The number of workers must be at least 1')
+        raise SystemExit(USAGE)
+
+    ted_backend = pop_option(sys.argv, '--ted-backend', default = 'apted')
+
+    if ted_backend not in backends:
+        print(f'Unknown TED backend: {ted_backend}')
+        raise SystemExit(USAGE)
+
+    ted_mode = pop_option(sys.argv, '--ted-mode', default = 'exact')
+    ted_budget = pop_option(sys.argv, '--ted-budget', default = None, cast = int)
+
+    if ted_mode not in ted_modes:
+        print(f'Unknown TED mode: {ted_mode}')
+        raise SystemExit(USAGE)
+
+    ted_memo_path = pop_option(sys.argv, '--ted-memo', default = None)
+
+    tscan_dtype = pop_option(sys.argv, '--tscan-dtype', default = None)
+
+    if tscan_dtype not in (None, 'float32', 'float64'):
+        print(f'Unknown T-Scan dtype: {tscan_dtype}')
+        raise SystemExit(USAGE)
+
     if len(sys.argv) == 3:
         if sys.argv[1] in os.listdir():
             script, file, dataset_label = sys.argv
@@ -34,7 +127,31 @@ def main():
             An optional second argument can be used to keep multiple outputs separated.
             Not specifying a label can lead to overwriting files.
 
+            The option --workers N spreads the texts over N processes.
+            The output is the same as with a single process.
+
+            The option --ted-backend selects how tree edit distances are
+            computed: 'apted' (default) or 'numpy', a vectorised
+            Zhang-Shasha implementation that gives the same distances and
+            is faster on long sentences.
+
+            The option --ted-mode approximate estimates every tree edit
+            distance from cheap lower and upper bounds instead. With
+            --ted-budget N, texts whose exact comparison would take more
+            than N compared node pairs are estimated as well. In both
+            cases a 'ted_approximated' column flags the estimated texts.
+
+            Exact tree edit distances are remembered by tree, so identical
+            pairs of trees are only compared once per run. The option
+            --ted-memo path also loads them from and saves them to the
+            given file, so they are reused in later runs.
+
+            Only the T-Scan columns that the indices need are read. With
+            --tscan-dtype float32 they are stored as 32-bit floats, which
+            halves their memory but rounds the T-Scan-based indices.
+
             e.g. python {script} dataset.csv v1
+                 python {script} dataset.csv v1 --workers 8
             ''')
             sys.exit()
 
@@ -57,19 +174,32 @@ def main():
 
     df['text_n'] = df.index
 
+    selected = list(indices)
+
+    if ted_mode == 'approximate' or ted_budget is not None:
+        selected += optional_indices
+
+    set_corpus(Corpus(file, selected = selected, tscan_dtype = tscan_dtype))
+
     # Add feature columns and fill them with empty values
-    for index in indices:
+    for index in selected:
         df[index] = np.nan
 
 
-    for index in indices:
-        apply_index_getter(df, index, level = 'doc')
+    # Extract all features text by text so that every Alpino parse is only read once
+    values = extract_indices(df.text_n, workers, (ted_backend, ted_mode, ted_budget, ted_memo_path), selected)
+
+    if ted_memo_path is not None:
+        ted_memo.save(ted_memo_path)
+
+    print(f'TED memo: {ted_memo.hits} hits, {ted_memo.misses} misses, {len(ted_memo)} distances')
+
 
+    apply_text_indices(df, values, level = 'doc', selected = selected, bulk = True)
 
     df.to_csv(f'vectorized_{filename}{dataset_label}.doc.csv', sep = ',')
 
-    for index in indices:
-        apply_index_getter(df, index, level = 'sen')
+    apply_text_indices(df, values, level = 'sen', selected = selected, bulk = True)
 
     df.to_csv(f'vectorized_{filename}{dataset_label}.sen.csv', sep = ',')
 
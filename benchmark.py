@@ -0,0 +1,307 @@
+#!/usr/bin/env python3
+
+import os
+import sys
+import random
+import regex as re
+import subprocess
+import xml.etree.ElementTree as ET
+from time import perf_counter
+from apted import APTED
+from apted.helpers import Tree
+from ted import ArrayTree, array_ted
+from parsing import get_words_before_main_verb
+from preprocessing import replace_parenthesis, sentence_limit_fix, capitalize_sentences, remove_numbering, normalise_text
+
+USAGE = f"Usage: python {sys.argv[0]} [--help | -h] | [<benchmark> ...]"
+
+#---------------------------------------------------#
+#   Synthetic Alpino-like trees                     #
+#                                                   #
+#   Labels are taken from the `cat` and `rel`       #
+#   values kept by `tree_to_brackets`.              #
+#                                                   #
+#---------------------------------------------------#
+
+CATS = ['smain', 'np', 'pp', 'ssub', 'inf', 'ppart', 'cp', 'conj', 'du', 'sv1', 'mwu', 'rel', 'ap']
+RELS = ['su', 'hd', 'obj1', 'mod', 'vc', 'body', 'cmp', 'det', 'cnj', 'dp', 'ld', 'predc', '--']
+
+def random_tree(rng, n_words = None, depth = 0):
+    '''
+    Returns apted.helpers.Tree -> random sentence tree with a `top` root.
+    '''
+    if n_words is None:
+        return Tree('top', random_tree(rng, rng.randint(4, 18), depth + 1))
+
+    if n_words == 1 or depth > 6:
+        return Tree(rng.choice(RELS))
+
+    n_children = min(n_words, rng.randint(2, 4))
+    cuts = sorted(rng.sample(range(1, n_words), n_children - 1))
+    spans = [b - a for a, b in zip([0] + cuts, cuts + [n_words])]
+
+    return Tree(rng.choice(CATS), *[random_tree(rng, span, depth + 1) for span in spans])
+
+def random_alpino_nodes(rng, n_words):
+    '''
+    Returns tuple -> (words, <node> elements in document order) of a random
+    Alpino-like sentence, with repeated words, finite verbs and main clause
+    conjuncts.
+    '''
+    vocabulary = ['ik', 'woon', 'in', 'Antwerpen', 'en', 'ga', 'naar', 'school', 'is', 'de']
+    words = [rng.choice(vocabulary) for _ in range(n_words)]
+
+    def build(begin, end, depth):
+        if end - begin == 1 or depth > 5:
+            word = words[begin] if rng.random() < 0.9 else rng.choice(vocabulary)
+            attributes = {'begin': str(begin), 'end': str(end), 'rel': rng.choice(RELS), 'word': word, 'lcat': rng.choice(['smain', 'sv1', 'np', 'pp'])}
+
+            if rng.random() < 0.4:
+                attributes['wvorm'] = 'pv'
+
+            return ET.Element('node', attributes)
+
+        cat = rng.choice(['smain', 'smain', 'conj', 'np', 'pp'])
+        node = ET.Element('node', {'begin': str(begin), 'end': str(end), 'cat': cat, 'rel': rng.choice(['cnj', 'dp', '--', 'body'])})
+
+        cuts = sorted(rng.sample(range(begin + 1, end), min(end - begin - 1, rng.randint(1, 3))))
+
+        for child_begin, child_end in zip([begin] + cuts, cuts + [end]):
+            node.append(build(child_begin, child_end, depth + 1))
+
+        return node
+
+    top = ET.Element('node', {'begin': '0', 'end': str(n_words), 'cat': 'top', 'rel': 'top'})
+    top.append(build(0, n_words, 1))
+
+    return words, list(top.iter('node'))
+
+def words_before_main_verb_naive(words, nodes):
+    '''
+    Compares every word with every node, as `get_words_before_main_verb`
+    did before it indexed the nodes by position. test_parsing.py checks
+    `get_words_before_main_verb` against it.
+    '''
+    cnt = 0
+    multiple = []
+
+    for order, word in enumerate(words):
+
+        for element in nodes:
+
+            if element.get('cat') == 'smain' and (element.get('rel') == 'cnj' or element.get('rel') == 'dp') and int(element.get('begin')) == order:
+                cnt = 0
+
+            if element.get('word') == word and int(element.get('begin')) == order:
+                if element.get('wvorm') == 'pv' and (element.get('lcat') == 'smain' or element.get('lcat') == 'sv1'):
+                    multiple.append(cnt)
+                cnt += 1
+
+    return multiple
+
+def timed(function, *args):
+    '''
+    Returns tuple -> (result of function(*args), seconds it took)
+    '''
+    start = perf_counter()
+    result = function(*args)
+    return result, perf_counter() - start
+
+#---------------------------------------------------#
+#   Benchmarks                                      #
+#---------------------------------------------------#
+
+def bench_ted_backends(sentence_lengths = (5, 10, 20, 40, 60), n_pairs = 20):
+    '''
+    TED between two sentences: APTED against the NumPy Zhang-Shasha backend
+    as the sentences grow longer.
+    '''
+    rng = random.Random(0)
+
+    print('words\tpairs\tAPTED (s)\tnumpy (s)\tspeedup')
+
+    for n_words in sentence_lengths:
+        trees = [Tree('top', random_tree(rng, n_words, 1)) for _ in range(2 * n_pairs)]
+        pairs = list(zip(trees[::2], trees[1::2]))
+
+        def apted():
+            return [APTED(tree1, tree2).compute_edit_distance() for tree1, tree2 in pairs]
+
+        def numpy():
+            arrays = [(ArrayTree.from_tree(tree1), ArrayTree.from_tree(tree2)) for tree1, tree2 in pairs]
+            return [array_ted(tree1, tree2) for tree1, tree2 in arrays]
+
+        expected, apted_time = timed(apted)
+        result, numpy_time = timed(numpy)
+
+        assert result == expected, 'NumPy TED differs from APTED'
+
+        print(f'{n_words}\t{n_pairs}\t{apted_time:.3f}\t{numpy_time:.3f}\t{apted_time / numpy_time:.2f}x')
+
+def random_text(rng, n_sentences):
+    '''
+    Returns str -> random learner-like text with missing spaces and
+    capitals, numbered sentences and square brackets.
+    '''
+    words = ['ik', 'woon', 'in', 'Antwerpen', 'de', 'het', 'huis', 'is', 'groot', 'en', 'naar', 'school', '[wij]', 'hebben']
+    sentences = []
+
+    for n in range(n_sentences):
+        sentence = ' '.join(rng.choice(words) for _ in range(rng.randint(3, 12)))
+
+        if rng.random() < 0.2:
+            sentence = f'{n + 1}. {sentence}'
+
+        sentences.append(sentence + rng.choice(['.', '. ', '.\n', '?', '', ';']))
+
+    return ''.join(sentences)
+
+#---------------------------------------------------#
+#   Rule-based preprocessing steps as they were     #
+#   before the patterns were compiled once.         #
+#---------------------------------------------------#
+
+def original_replace_parenthesis(text):
+    for char in text:
+        if char == '[':
+            text = text.replace('[', '(')
+        if char ==']':
+            text = text.replace(']', ')')
+    return text
+
+def original_sentence_limit_fix(text):
+    pattern = re.compile(r'(?<=[a-z])(\s)?(\.|\?|\!|\;)*(?<! )((?=[A-Z])|($))')
+
+    def get_punctuation(match):
+        return match.group(3) + ' '
+
+    return re.sub(pattern, get_punctuation, text)
+
+def original_capitalize_sentences(text):
+    pattern = re.compile(r'(((?<=[a-z])(\.|\?|\!\;) *)([a-z]))')
+    pattern2 = re.compile(r'(^[a-z])')
+    pattern3 = re.compile(r'(?<=[a-z]\.|\?|\!\;)([a-z])')
+
+    def capitalize(match):
+        return match.group(1).upper()
+
+    corrected_text = []
+
+    for line in text.split('\n'):
+        corrected_line = re.sub(pattern, capitalize, line.strip())
+        corrected_line = re.sub(pattern2, capitalize, corrected_line.strip())
+        corrected_line = re.sub(pattern3, capitalize, corrected_line.strip())
+        corrected_text.append(corrected_line)
+
+    return '\n'.join(corrected_text)
+
+def original_remove_numbering(text):
+    pattern = re.compile(r'^\d[\.|\-]\s?')
+
+    return '\n'.join(re.sub(pattern, '', line) for line in text.split('\n'))
+
+def bench_normalise(n_texts = 2000, sentence_counts = (5, 20, 80)):
+    '''
+    Rule-based preprocessing of a dataset: the original chain of steps
+    against `normalise_text`, which also has to match the current steps.
+    '''
+    rng = random.Random(0)
+
+    print('sentences\ttexts\toriginal (s)\tnormalise_text (s)\tspeedup')
+
+    for n_sentences in sentence_counts:
+        texts = [random_text(rng, n_sentences) for _ in range(n_texts)]
+
+        def original():
+            return [original_remove_numbering(original_capitalize_sentences(original_sentence_limit_fix(original_replace_parenthesis(text)))) for text in texts]
+
+        def normalised():
+            return [normalise_text(text) for text in texts]
+
+        expected, original_time = timed(original)
+        result, normalise_time = timed(normalised)
+
+        assert result == expected, 'Normalised text differs from the original steps'
+        assert result == [remove_numbering(capitalize_sentences(sentence_limit_fix(replace_parenthesis(text)))) for text in texts], 'Normalised text differs from the current steps'
+
+        print(f'{n_sentences}\t{n_texts}\t{original_time:.3f}\t{normalise_time:.3f}\t{original_time / normalise_time:.2f}x')
+
+def bench_words_before_main_verb(sentence_lengths = (5, 20, 60, 120), n_sentences = 200):
+    '''
+    Words before each finite main verb: every word against every node
+    against nodes indexed by position.
+    '''
+    rng = random.Random(0)
+
+    print('words\tsentences\tnaive (s)\tindexed (s)\tspeedup')
+
+    for n_words in sentence_lengths:
+        sentences = [random_alpino_nodes(rng, n_words) for _ in range(n_sentences)]
+
+        def naive():
+            return [words_before_main_verb_naive(words, nodes) for words, nodes in sentences]
+
+        def indexed():
+            return [get_words_before_main_verb(words, nodes) for words, nodes in sentences]
+
+        expected, naive_time = timed(naive)
+        result, indexed_time = timed(indexed)
+
+        assert result == expected, 'Indexed word counts differ from the naive ones'
+
+        print(f'{n_words}\t{n_sentences}\t{naive_time:.3f}\t{indexed_time:.3f}\t{naive_time / indexed_time:.2f}x')
+
+def bench_startup(repeats = 5):
+    '''
+    Start-up time of the command line scripts: importing their modules in a
+    new interpreter and printing their help, without loading any model.
+    '''
+    directory = os.path.dirname(os.path.abspath(__file__))
+
+    commands = {
+        'python (baseline)': [sys.executable, '-c', 'pass'],
+        'import preprocessing': [sys.executable, '-c', 'import preprocessing'],
+        'import features': [sys.executable, '-c', 'import features'],
+        'preprocessing.py --help': [sys.executable, 'preprocessing.py', '--help'],
+        'analysis.py --help': [sys.executable, 'analysis.py', '--help'],
+        }
+
+    def run(command):
+        subprocess.run(command, cwd = directory, check = True, stdout = subprocess.DEVNULL)
+
+    print('command\tbest (s)')
+
+    for name, command in commands.items():
+        best = min(timed(run, command)[1] for _ in range(repeats))
+        print(f'{name}\t{best:.3f}')
+
+
+benchmarks = {
+    'ted_backends': bench_ted_backends,
+    'normalise': bench_normalise,
+    'words_before_main_verb': bench_words_before_main_verb,
+    'startup': bench_startup,
+    }
+
+def main():
+    names = sys.argv[1:] or list(benchmarks)
+
+    if '--help' in names or '-h' in names:
+        print(f'''
+        {USAGE}
+
+        Available benchmarks: {', '.join(benchmarks)}
+        Runs every benchmark if none is given.
+        ''')
+        sys.exit()
+
+    for name in names:
+        if name not in benchmarks:
+            print(f'Unknown benchmark: {name}')
+            raise SystemExit(USAGE)
+
+        print(f'\n{name}: {" ".join(benchmarks[name].__doc__.split())}\n')
+        benchmarks[name]()
+
+if __name__ == "__main__":
+   main()
@@ -1,28 +1,146 @@
 #!/usr/bin/env python3
 
-import os
-import sys
 import numpy as np
+import pandas as pd
 import regex as re
-import xml.etree.ElementTree as ET
-from apted import APTED
-from apted.helpers import Tree
-from parsing import tree_to_brackets
+from alpino import get_records, get_store
+from ted import text_ted, is_approximated
 from utils import *
-from get_tscan import df_doc, df_sen
+from get_tscan import TScanOutput
 
-file = sys.argv[1]
-filename = file[:-4]
+#---------------------------------------------------#
+#   Corpus.                                         #
+#                                                   #
+#   The dataset whose features are extracted. Its   #
+#   Alpino and T-Scan output are only looked up on  #
+#   first use, so importing this module does not    #
+#   touch the file system.                          #
+#                                                   #
+#---------------------------------------------------#
+
+class Corpus:
+    '''
+    Alpino and T-Scan output of a preprocessed dataset.
+
+    file = preprocessed dataset.csv filename
+    alpino_directory = directory with the Alpino output of every dataset
+    tscan_directory = directory with the T-Scan output of every dataset
+    selected = indices that will be extracted, defaults to `indices`; only
+               the T-Scan columns they need are read
+    tscan_dtype = dtype of the T-Scan columns, see `get_tscan.read_tscan`
+    '''
+
+    def __init__(self, file, alpino_directory = './alpino_output', tscan_directory = './tscan_output', selected = None, tscan_dtype = None):
+        self.file = file
+        self.filename = file[:-4]
+
+        # Alpino-output directory
+        self.output_path = f'{alpino_directory}/{self.filename}'
+
+        selected = selected or indices
+        columns = {level: sorted({level_columns[index] for index in selected if index in level_columns}) for level, level_columns in tscan_columns.items()}
+
+        self.tscan = TScanOutput(self.filename, tscan_directory, columns, tscan_dtype)
+        self._n_texts = None
+
+    @property
+    def n_texts(self):
+        '''
+        Number of texts to be analysed based on the Alpino-output, stored as
+        a directory, an archive or a compact corpus, see `alpino.open_store`.
+        '''
+        if self._n_texts is None:
+            self._n_texts = len(get_store(self.output_path).texts())
+        return self._n_texts
+
+    def text_path(self, n):
+        return f'{self.output_path}/text_{n}.txt'
+
+
+corpus = None
+
+def set_corpus(new_corpus):
+    '''
+    Sets the corpus the feature getters extract from.
+    '''
+    global corpus
+    corpus = new_corpus
+
+def get_corpus():
+    if corpus is None:
+        raise RuntimeError('No corpus set, see `set_corpus`')
+    return corpus
 
 #---------------------------------------------------#
-#   Alpino-generated features                       #
+#   T-Scan columns of each T-Scan-based index.      #
 #---------------------------------------------------#
 
-# Alpino-output directory
-output_path = f'./alpino_output/{filename}'
+tscan_columns = {
+    'doc': {
+        'sentence_length': 'Wrd_per_zin',
+        'n_words': 'Word_per_doc',
+        'word_frequency': 'Freq1000_inhwrd',
+        'clause_incidence': 'Pv_Alpino_per_zin',
+        'rel_clauses': 'Betr_bijzin_per_zin',
+        's_bars': 'Bijzin_per_zin',
+        'infinitive_clause_incidence': 'Infin_compl_per_zin',
+        'n_mod_np': 'Bijv_bep_dz_zbijzin',
+        'incidence_negation': 'Ontk_tot_d'
+        },
+    'sen': {
+        'sentence_length': 'Wrd_per_zin',
+        'n_words': 'Wrd_per_zin',
+        'word_frequency': 'Freq1000_inhwrd',
+        'clause_incidence': 'Pv_Alpino_per_zin',
+        'rel_clauses': 'Betr_bijzin_per_zin',
+        's_bars': 'Bijzin_per_zin',
+        'infinitive_clause_incidence': 'Infin_compl_per_zin',
+        'n_mod_np': 'Bijv_bep_dz_zbijzin',
+        'incidence_negation': 'Ontk_tot_d'
+        }
+    }
+
+def get_tscan_value(text_n, index, level):
+    '''
+    Returns T-Scan's value of `index` for text `text_n`: a single value at
+    document level and a list with one value per sentence at sentence level.
+    '''
+    tscan = get_corpus().tscan
+    column = tscan_columns[level][index]
+
+    if level == 'doc':
+        return tscan.doc.at[text_n, column]
+
+    if level == 'sen':
+        values = tscan.sentences.get(text_n, column)
+
+        # Like `DataFrame.at`, a text with a single sentence gives a single value
+        if len(values) == 1:
+            return values[0].tolist()
 
-# Define number of texts to be analysed based on the Alpino-output
-n_texts = len([f for f in os.listdir(output_path) if f.endswith('.txt')])
+        return values.tolist()
+
+def get_tscan_indices(text_ns, selected):
+    '''
+    Looks up the document-level T-Scan-based indices of all texts at once.
+
+    text_ns = text numbers
+    selected = T-Scan-based indices to look up
+
+    Returns pd.DataFrame -> one column for each selected index and one row
+    for each text, in the same order as `text_ns`.
+    '''
+    tscan = get_corpus().tscan
+    columns = [tscan_columns['doc'][index] for index in selected]
+
+    df = tscan.doc.loc[[str(n) for n in text_ns], columns]
+    df.columns = selected
+
+    return df
+
+#---------------------------------------------------#
+#   Alpino-generated features                       #
+#---------------------------------------------------#
 
 pattern = re.compile(r'(?<=text_)(\d+)(\.p\.)(\d+)(\.s\.)(\d+)')
 def get_metadata(file):
@@ -63,9 +181,9 @@ def get_mean_ted(path, level = 'doc'):
     the function returns None for an empty mean TED.
     '''
 
-    n_sentences = get_n_sentences(path)
+    records = get_records(path)
 
-    if n_sentences == 1:
+    if len(records) == 1:
         print('''
         Text is composed of one sentence only or has been parsed as such.
         No TED score will be returned.
@@ -74,47 +192,16 @@ def get_mean_ted(path, level = 'doc'):
         return mean_ted
 
 
-    distances = {}
-
-    parses = get_sentences(path)
-
-    for n, xml in enumerate(parses):
-        txt_nr, p_n, s_n = get_metadata(xml)
-
-        for compared_n, compared_xml in enumerate(parses):
-            if xml == compared_xml:
-                continue
+    trees = [record.summary for xml, record in records]
+    s_ns = np.array([get_metadata(xml)[2] for xml, record in records])
 
-            else:
-                compared_txt_nr, compared_p_n, compared_s_n = get_metadata(compared_xml)
+    # Every unordered pair once, skipping sentences with the same sentence number
+    upper = np.triu(np.ones((len(records), len(records)), dtype = bool), k = 1)
+    compared = upper & (s_ns[:, None] != s_ns[None, :])
 
-                pair = f'{p_n}_{s_n}, {compared_p_n}_{compared_s_n}'
-                reverse_pair = f'{compared_p_n}_{compared_s_n}, {p_n}_{s_n}'
+    distances, approximated = text_ted(trees, zip(*np.nonzero(compared)))
 
-                if s_n == compared_s_n:
-                    continue
-
-                if pair in distances or reverse_pair in distances:
-                    continue
-
-                else:
-                    with open(f'{path}/{xml}', encoding = 'utf-8') as f:
-                        reference_tree = tree_to_brackets(ET.parse(f))
-
-                    with open(f'{path}/{compared_xml}', encoding = 'utf-8') as f2:
-                        compared_tree = tree_to_brackets(ET.parse(f2))
-
-
-                    tr1, tr2 = map(Tree.from_text, (reference_tree, compared_tree))
-
-                    apted = APTED(tr1, tr2)
-                    ted = apted.compute_edit_distance()
-                    mapping = apted.compute_edit_mapping()
-
-
-                    distances[pair] = ted
-
-    values = list(distances.values())
+    values = distances[compared].tolist()
     mean_ted = np.mean(values)
 
     if level == 'doc':
@@ -137,54 +224,26 @@ def get_synstut_adjacent(path, level = 'doc'):
     Returns list-> distance between each sentence and the next following sentence
     '''
 
-    n_sentences = get_n_sentences(path)
+    records = get_records(path)
 
-    if n_sentences == 1:
+    if len(records) == 1:
         print('''
         Text is composed of one sentence only or has been parsed as such.
         No TED score will be returned.''')
         syntactic_similarity_score = None
         return syntactic_similarity_score
 
-    distances = {}
-
-    parses = get_sentences(path)
-
-    for n, xml in enumerate(parses):
-        txt_nr, p_n, s_n = get_metadata(xml)
-
-        if n + 1 == len(parses):
-            break
-        else:
-            compared_txt_nr, compared_p_n, compared_s_n = get_metadata(parses[n + 1])
-            compared_xml = parses[n + 1]
-
-
-        pair = f'{p_n}_{s_n}, {compared_p_n}_{compared_s_n}'
-        reverse_pair = f'{compared_p_n}_{compared_s_n}, {p_n}_{s_n}'
-
-        if s_n == compared_s_n:
-            continue
-
-        if pair in distances or reverse_pair in distances:
-            continue
-
-
-        with open(f'{path}/text_{txt_nr}.p.{p_n}.s.{s_n}.xml', encoding = 'utf-8') as f:
-            reference_tree = tree_to_brackets(ET.parse(f))
-
-        with open(f'{path}/text_{compared_txt_nr}.p.{compared_p_n}.s.{compared_s_n}.xml', encoding = 'utf-8') as f2:
-            compared_tree = tree_to_brackets(ET.parse(f2))
+    trees = [record.summary for xml, record in records]
+    s_ns = [get_metadata(xml)[2] for xml, record in records]
 
+    pairs = [(n, n + 1) for n in range(len(records) - 1) if s_ns[n] != s_ns[n + 1]]
 
-        tr1, tr2 = map(Tree.from_text, (reference_tree, compared_tree))
-
-        apted = APTED(tr1, tr2)
-        ted = apted.compute_edit_distance()
-        mapping = apted.compute_edit_mapping()
+    matrix, approximated = text_ted(trees, pairs)
 
+    distances = {}
 
-        distances[f'{s_n}, {compared_s_n}'] = ted
+    for n, compared_n in pairs:
+        distances[f'{s_ns[n]}, {s_ns[compared_n]}'] = matrix[n, compared_n].item()
 
     values = list(distances.values())
     mean_ted = np.mean(values)
@@ -195,6 +254,21 @@ def get_synstut_adjacent(path, level = 'doc'):
     if level == 'sen':
         return values
 
+def get_ted_approximated(path, level = 'doc'):
+    '''
+    Returns bool -> whether the TED-based indices of the text are estimates
+    instead of exact distances, see `ted.is_approximated`.
+
+    The same value is returned at both levels.
+    '''
+
+    records = get_records(path)
+
+    if len(records) == 1:
+        return False
+
+    return is_approximated([record.summary for xml, record in records])
+
 def get_n_words_main_verb(path, level = 'doc'):
     '''
     Counts the number of words before the main verb of the sentence,
@@ -207,39 +281,8 @@ def get_n_words_main_verb(path, level = 'doc'):
 
     total = []
 
-    sentences = get_sentences(path)
-
-
-    for sentence in sentences:
-        with open(f'{path}/{sentence}') as f:
-            root = ET.parse(f)
-
-        cnt = 0
-        multiple = []
-        order = 0
-        loop = 0
-
-        full_sentence = root.find('sentence').text.split(' ')
-
-        for word in full_sentence:
-            if loop != 0:
-                order += 1
-            loop += 1
-
-            for element in root.iter('node'):
-
-
-                if element.get('cat') == 'smain' and (element.get('rel') == 'cnj' or element.get('rel') == 'dp') and int(element.get('begin')) == order:
-                    cnt = 0
-
-
-                if element.get('word') == word and int(element.get('begin')) == order:
-                    if element.get('wvorm') == 'pv' and (element.get('lcat') == 'smain' or element.get('lcat') == 'sv1'):
-                        multiple.append(cnt)
-                    cnt += 1
-
-        for item in  multiple:
-            total.append(item)
+    for sentence, record in get_records(path):
+        total.extend(record.words_before_main_verb)
 
     mean_number = np.mean(total)
 
@@ -249,52 +292,12 @@ def get_n_words_main_verb(path, level = 'doc'):
     if level == 'sen':
         return total
 
-def get_synt_feat(root:ET.Element):
-    '''
-    Syntactic features on sentence level.
-
-    Controls the <node lcat> attribute when counting NPs and PPs in the
-    entire text and the <node pos> and <node rel> attributes when counting VPs
-    and stores the corresponding <node word> attribute in a list.
-
-    Requires root to be an ElementTree Element.
-
-    Returns a tuple with three integers:
-
-    (number of vps, number of nps, number of pps)
-    '''
-    vp = []
-    np = []
-    pp = []
-
-    node_count = 0
-
-    root = root.getroot()
-
-    for element in root.iter('*'):
-        if element.tag == 'node':
-            lcat = element.get('lcat')
-            pos = element.get('pos')
-            rel = element.get('rel')
-            word = element.get('word')
-
-            if lcat:
-                node_count += 1
-
-            if pos == 'verb' and rel == 'hd':
-                vp.append(word)
-
-            if lcat == 'np':
-                np.append(word)
-
-            if lcat == 'pp':
-                pp.append(word)
-
-    return(len(vp), len(np), len(pp), node_count)
-
 def get_total_vp_np_pp(path):
     '''
-    Total number of syntactic features on text level.
+    Total number of syntactic features on text level, relative to the
+    number of nodes with a <node lcat> attribute in the text.
+
+    Counts are taken from the sentence records, see `parsing.visit_sentence`.
 
     path = text directory location
 
@@ -303,24 +306,17 @@ def get_total_vp_np_pp(path):
     Returns tuple -> total vp, total np, total pp for entire text
     '''
 
-    sentences = get_sentences(path)
-
     total_vp = 0
     total_np = 0
     total_pp = 0
     total_nodes = 0
 
 
-    for sentence in (sentences):
-        with open(f'{path}/{sentence}') as f:
-            root = ET.parse(f)
-
-        synt_feat = get_synt_feat(root)
-
-        total_vp += synt_feat[0]
-        total_np += synt_feat[1]
-        total_pp += synt_feat[2]
-        total_nodes += synt_feat[3]
+    for sentence, record in get_records(path):
+        total_vp += record.n_vp
+        total_np += record.n_np
+        total_pp += record.n_pp
+        total_nodes += record.n_nodes
 
     return(total_vp/total_nodes, total_np/total_nodes, total_pp/total_nodes)
 
@@ -335,22 +331,15 @@ def get_phrase_incidence_sentence_level(path):
     Returns tuple with lists -> ([vp in each sentence], [np in each sentence], [pp in each sentence])
     '''
 
-    sentences = get_sentences(path)
-
     total_vp = []
     total_np = []
     total_pp = []
 
 
-    for sentence in (sentences):
-        with open(f'{path}/{sentence}') as f:
-            root = ET.parse(f)
-
-        synt_feat = get_synt_feat(root)
-
-        total_vp.append(synt_feat[0])
-        total_np.append(synt_feat[1])
-        total_pp.append(synt_feat[2])
+    for sentence, record in get_records(path):
+        total_vp.append(record.n_vp)
+        total_np.append(record.n_np)
+        total_pp.append(record.n_pp)
 
     return(total_vp, total_np, total_pp)
 
@@ -363,24 +352,12 @@ def get_sentence_length(text_n, level = 'doc'):
 
     '''
 
-    if level == 'doc':
-        value = df_doc.at[text_n, 'Wrd_per_zin']
-
-    if level == 'sen':
-        value = df_sen.at[text_n, 'Wrd_per_zin'].tolist()
-
-    return value
+    return get_tscan_value(text_n, 'sentence_length', level)
 
 
 def get_clause_incidence(text_n, level = 'doc'):
 
-    if level == 'doc':
-        value = df_doc.at[text_n, 'Pv_Alpino_per_zin']
-
-    if level == 'sen':
-        value = df_sen.at[text_n, 'Pv_Alpino_per_zin'].tolist()
-
-    return value
+    return get_tscan_value(text_n, 'clause_incidence', level)
 
 
 
@@ -395,33 +372,15 @@ def get_pp_incidence(path, level = 'doc'):
 
 def get_rel_clauses(text_n, level = 'doc'):
 
-    if level == 'doc':
-        value = df_doc.at[text_n, 'Betr_bijzin_per_zin']
-
-    if level == 'sen':
-        value = df_sen.at[text_n, 'Betr_bijzin_per_zin'].tolist()
-
-    return value
+    return get_tscan_value(text_n, 'rel_clauses', level)
 
 def get_s_bars(text_n, level = 'doc'):
 
-    if level == 'doc':
-        value = df_doc.at[text_n, 'Bijzin_per_zin']
-
-    if level == 'sen':
-        value = df_sen.at[text_n, 'Bijzin_per_zin'].tolist()
-
-    return value
+    return get_tscan_value(text_n, 's_bars', level)
 
 def get_infinitive_clause_incidence(text_n, level = 'doc'):
 
-    if level == 'doc':
-        value = df_doc.at[text_n, 'Infin_compl_per_zin']
-
-    if level == 'sen':
-        value = df_sen.at[text_n, 'Infin_compl_per_zin'].tolist()
-
-    return value
+    return get_tscan_value(text_n, 'infinitive_clause_incidence', level)
 
 def get_vp_incidence(path, level = 'doc'):
 
@@ -433,43 +392,19 @@ def get_vp_incidence(path, level = 'doc'):
 
 def get_n_mod_np(text_n, level = 'doc'):
 
-    if level == 'doc':
-        value = df_doc.at[text_n, 'Bijv_bep_dz_zbijzin']
-
-    if level == 'sen':
-        value = df_sen.at[text_n, 'Bijv_bep_dz_zbijzin'].tolist()
-
-    return value
+    return get_tscan_value(text_n, 'n_mod_np', level)
 
 def get_incidence_negation(text_n, level = 'doc'):
 
-    if level == 'doc':
-        value = df_doc.at[text_n, 'Ontk_tot_d']
-
-    if level == 'sen':
-        value = df_sen.at[text_n, 'Ontk_tot_d'].tolist()
-
-    return value
+    return get_tscan_value(text_n, 'incidence_negation', level)
 
 def get_n_words(text_n, level = 'doc'):
 
-    if level == 'doc':
-        value = df_doc.at[text_n, 'Word_per_doc']
-
-    if level == 'sen':
-        value = df_sen.at[text_n, 'Wrd_per_zin'].tolist()
-
-    return value
+    return get_tscan_value(text_n, 'n_words', level)
 
 def get_word_frequency(text_n, level = 'doc'):
 
-    if level == 'doc':
-        value = df_doc.at[text_n, 'Freq1000_inhwrd']
-
-    if level == 'sen':
-        value = df_sen.at[text_n, 'Freq1000_inhwrd'].tolist()
-
-    return value
+    return get_tscan_value(text_n, 'word_frequency', level)
 
 # Generate feature/column labels
 indices = [
@@ -526,12 +461,21 @@ _print_friendly_indices = [
     ]
 print_friendly_indices = dict(zip(indices, _print_friendly_indices))
 
+# Indices that are only added to the output on request
+optional_indices = [
+    'ted_approximated'
+    ]
+
+index_getters['ted_approximated'] = get_ted_approximated
+print_friendly_indices['ted_approximated'] = 'TED approximated'
+
 alpino_feats = [
     'syntactic_similarity',
     'pp_incidence',
     'vp_incidence',
     'mean_ted',
-    'n_words_main_verb'
+    'n_words_main_verb',
+    'ted_approximated'
     ]
 
 tscan_feats = [
@@ -563,7 +507,7 @@ def get_index(n, index, level = None):
 
     if index in alpino_feats:
 
-        path = f'{output_path}/text_{n}.txt'
+        path = get_corpus().text_path(n)
 
     if index in tscan_feats:
         path = str(n)
@@ -577,3 +521,54 @@ def get_index(n, index, level = None):
 
 def apply_index_getter(dataframe, feature, level):
     dataframe[feature] = dataframe.text_n.apply(get_index, index = feature, level = level)
+
+
+# Levels at which T-Scan-based indices can be looked up for all texts at once
+bulk_levels = ('doc',)
+
+def get_text_level_indices(level, selected = None, bulk = False):
+    '''
+    Returns list -> the selected indices that are extracted text by text at
+    `level`, leaving out the T-Scan-based ones if they are looked up in bulk.
+    '''
+    selected = selected or indices
+
+    if bulk and level in bulk_levels:
+        return [index for index in selected if index not in tscan_feats]
+
+    return list(selected)
+
+def get_text_indices(n, levels = ('doc', 'sen'), selected = None, bulk = False):
+    '''
+    Extracts every index for one text at each of the given levels.
+
+    All indices of a text are extracted one after the other, so that its
+    Alpino output is parsed once and then served from the sentence cache.
+
+    n = text number
+    selected = list of indices to extract, defaults to `indices`
+    bulk = leave out the indices that `apply_text_indices` looks up for all
+           texts at once, see `get_text_level_indices`
+
+    Returns dict -> {level: [value for each extracted index]}
+    '''
+
+    return {level: [get_index(n, index, level) for index in get_text_level_indices(level, selected, bulk)] for level in levels}
+
+def apply_text_indices(dataframe, values, level, selected = None, bulk = False):
+    '''
+    Fills the feature columns of `dataframe` with the values returned by
+    `get_text_indices` for each of its texts, in the same order.
+
+    If `bulk` is True, the T-Scan-based indices are looked up for all texts
+    at once with `get_tscan_indices` instead.
+    '''
+    for i, index in enumerate(get_text_level_indices(level, selected, bulk)):
+        dataframe[index] = pd.Series([value[level][i] for value in values], index = dataframe.index)
+
+    if bulk and level in bulk_levels:
+        selected_tscan = [index for index in selected or indices if index in tscan_feats]
+        tscan = get_tscan_indices(dataframe.text_n, selected_tscan)
+
+        for index in selected_tscan:
+            dataframe[index] = tscan[index].to_numpy()
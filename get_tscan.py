@@ -1,24 +1,129 @@
 #!/usr/bin/env python3
 
-import os
-import sys
+import numpy as np
 import pandas as pd
 from utils import get_text_n_from_df
 #---------------------------------------------------#
 #   Open T-scan output from different analysis' pov #
 #                                                   #
-#   df_doc = T-Scan's analysis on document level    #
-#   df_sen = T-Scan's analysis on sentence level    #
+#   doc = T-Scan's analysis on document level       #
+#   sen = T-Scan's analysis on sentence level       #
+#                                                   #
+#   Both files are only read on first use.          #
 #                                                   #
 #---------------------------------------------------#
 
-file = sys.argv[1]
-filename = file[:-4]
+def read_tscan(path, columns = None, float_dtype = None, chunksize = 100000):
+    '''
+    Reads a T-Scan output file and indexes it by text number.
+
+    columns = T-Scan columns to keep, defaults to every column
+    float_dtype = dtype the kept columns are converted to, e.g. 'float32';
+                  by default pandas infers them, which keeps every value exact
+    chunksize = number of rows read at a time, so that only the kept
+                columns of the whole file are held in memory
+
+    Returns pd.DataFrame -> T-Scan's analysis with a `text_n` index.
+    '''
+    usecols = None if columns is None else ['Inputfile'] + [column for column in columns if column != 'Inputfile']
+
+    dtype = {'Inputfile': 'category'}
+
+    if float_dtype is not None and columns is not None:
+        dtype.update({column: float_dtype for column in columns})
+
+    chunks = []
+
+    for chunk in pd.read_csv(path, sep = ',', usecols = usecols, dtype = dtype, chunksize = chunksize):
+
+        # Every distinct file name is only matched once
+        inputfiles = chunk.Inputfile.cat
+        text_ns = np.array([get_text_n_from_df(name) for name in inputfiles.categories], dtype = object)
+
+        chunk = chunk.drop(columns = 'Inputfile')
+        chunk.index = pd.Index(text_ns[inputfiles.codes.to_numpy()], name = 'text_n')
+        chunks.append(chunk)
+
+    return pd.concat(chunks)
+
+
+class SentenceTable:
+    '''
+    T-Scan's sentence-level analysis grouped per text.
+
+    The rows are sorted by text number, keeping their order within a text,
+    so that the sentences of text `text_n` are the rows between
+    `offsets[i]` and `offsets[i + 1]` of every column, where
+    i = `texts[text_n]`. Columns are converted to contiguous arrays on
+    first use, and the values of a text are a slice of them.
+    '''
+
+    def __init__(self, df):
+        self.df = df
+
+        keys = df.index.to_numpy()
+        self.order = np.argsort(keys, kind = 'stable')
+        keys = keys[self.order]
+
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]]) if len(keys) else np.array([], dtype = np.int64)
+
+        self.texts = {key: i for i, key in enumerate(keys[starts].tolist())}
+        self.offsets = np.append(starts, len(keys))
+        self._columns = {}
+
+    def column(self, name):
+        if name not in self._columns:
+            self._columns[name] = np.ascontiguousarray(self.df[name].to_numpy()[self.order])
+        return self._columns[name]
+
+    def get(self, text_n, name):
+        '''
+        Returns np.ndarray -> view of the values of column `name` for every
+        sentence of text `text_n`.
+
+        Raises KeyError if the text is not in the analysis.
+        '''
+        i = self.texts[text_n]
+        return self.column(name)[self.offsets[i]:self.offsets[i + 1]]
+
+
+class TScanOutput:
+    '''
+    T-Scan's analysis of a dataset at document and sentence level.
+
+    filename = name of the raw *.csv dataset without extension
+    directory = T-Scan output directory
+    columns = dict -> {'doc': T-Scan columns to read, 'sen': ...},
+              defaults to every column at both levels
+    float_dtype = see `read_tscan`
+    '''
+
+    def __init__(self, filename, directory = './tscan_output', columns = None, float_dtype = None):
+        self.filename = filename
+        self.directory = directory
+        self.columns = columns or {}
+        self.float_dtype = float_dtype
+        self._doc = None
+        self._sen = None
+        self._sentences = None
+
+    @property
+    def doc(self):
+        if self._doc is None:
+            self._doc = read_tscan(f'{self.directory}/{self.filename}_total.doc.csv', self.columns.get('doc'), self.float_dtype)
+        return self._doc
 
-df_doc = pd.read_csv(f'./tscan_output/{filename}_total.doc.csv', sep = ',')
-df_sen = pd.read_csv(f'./tscan_output/{filename}_total.sen.csv', sep = ',')
+    @property
+    def sen(self):
+        if self._sen is None:
+            self._sen = read_tscan(f'{self.directory}/{self.filename}_total.sen.csv', self.columns.get('sen'), self.float_dtype)
+        return self._sen
 
-df_doc['text_n'] = df_doc.Inputfile.apply(get_text_n_from_df)
-df_doc = df_doc.set_index('text_n')
-df_sen['text_n'] = df_sen.Inputfile.apply(get_text_n_from_df)
-df_sen = df_sen.set_index('text_n')
+    @property
+    def sentences(self):
+        '''
+        SentenceTable of the sentence-level analysis, see `SentenceTable`.
+        '''
+        if self._sentences is None:
+            self._sentences = SentenceTable(self.sen)
+        return self._sentences
@@ -1,102 +1,374 @@
 #!/usr/bin/env python3
+import warnings
 import xml.etree.ElementTree as ET
+from collections import namedtuple, deque
+from apted.helpers import Tree
+from ted import TreeSummary
+
+#---------------------------------------------------#
+#   Node helpers                                    #
+#---------------------------------------------------#
+
+def get_degree(node):
+    degree = len(node)
+    return degree
+
+def is_internal(node):
+    if get_degree(node) >= 1:
+        return True
+    else:
+        return False
+
+def is_leaf(node):
+    if is_internal(node) == False:
+        return True
+    else:
+        return False
+
+def is_subtree(node):
+    if node.get('cat')is not None:
+        return True
+    else:
+        return False
+
+def wrap(leaf):
+    wrapped = str('{' + leaf + '}')
+    return wrapped
+
+def get_label(node):
+    name = node.get('cat')
+    if name.startswith('mwu'):
+        name = 'mwu'
+    return name
+
+def open_wrap(label):
+    bracket = '{'
+    return str(bracket + label)
+
+def close_wrap():
+    bracket = '}'
+    return bracket
+
+def get_span(node):
+    if isinstance(node, ET.Element):
+        begin = node.get('begin')
+        end = node.get('end')
+
+    else:
+        begin = None
+        end = None
+
+    return begin, end
+
+#---------------------------------------------------#
+#   Alpino XML reader                               #
+#---------------------------------------------------#
+
+def read_alpino(source):
+    '''
+    Parses an Alpino XML file with ElementTree's C parser.
+
+    source = file name, binary file object or bytes, e.g. the content of
+             a file read from an archive, see `alpino.open_store`
+
+    Returns xml.etree.ElementTree.ElementTree
+    '''
+    if isinstance(source, bytes):
+        return ET.ElementTree(ET.fromstring(source))
+
+    return ET.parse(source)
+
+#---------------------------------------------------#
+#   Tree builders.                                  #
+#                                                   #
+#   The navigation reports every opened subtree,    #
+#   leaf and closing bracket to a builder, which    #
+#   either writes the bracket notation or builds    #
+#   the APTED tree directly.                        #
+#                                                   #
+#---------------------------------------------------#
+
+class BracketBuilder:
+    '''
+    Writes the bracket notation of the navigated tree.
+    '''
+
+    def __init__(self):
+        self.brackets = []
+
+    def open(self, label):
+        self.brackets.append(open_wrap(label))
+
+    def leaf(self, label):
+        self.brackets.append(wrap(label))
+
+    def close(self):
+        self.brackets.append(close_wrap())
 
-def tree_to_brackets(tree:ET.Element):
+    def result(self):
+        return ''.join(self.brackets)
 
+
+class TreeBuilder:
+    '''
+    Builds the apted.helpers.Tree of the navigated tree.
+
+    Follows `Tree.from_text` step by step, so the result has the same
+    labels and structure as `Tree.from_text(tree_to_brackets(tree))`
+    without writing and reading back the bracket string.
+    '''
+
+    def __init__(self):
+        self.stack = []
+        self.tree_stack = []
+
+    def open(self, label):
+        self.stack.append(label)
+
+    def leaf(self, label):
+        self.open(label)
+        self.close()
+
+    def close(self):
+        label = self.stack.pop()
+        children = deque()
+
+        while self.tree_stack and self.tree_stack[-1][1] > len(self.stack):
+            child, _ = self.tree_stack.pop()
+            children.appendleft(child)
+
+        self.tree_stack.append((Tree(label, *children), len(self.stack)))
+
+    def result(self):
+        return self.tree_stack[0][0]
+
+class StructureBuilder(BracketBuilder):
+    '''
+    Writes the bracket notation of the navigated tree and also records its
+    nodes in preorder: the label of every node and the position of its
+    parent in that order, -1 for a root.
+    '''
+
+    def __init__(self):
+        super().__init__()
+        self.labels = []
+        self.parents = []
+        self.open_nodes = []
+
+    def _add(self, label):
+        self.parents.append(self.open_nodes[-1] if self.open_nodes else -1)
+        self.labels.append(label)
+
+    def open(self, label):
+        super().open(label)
+        self._add(label)
+        self.open_nodes.append(len(self.labels) - 1)
+
+    def leaf(self, label):
+        super().leaf(label)
+        self._add(label)
+
+    def close(self):
+        super().close()
+        if self.open_nodes:
+            self.open_nodes.pop()
+
+    def result(self):
+        return super().result(), self.labels, self.parents
+
+#---------------------------------------------------#
+#   Tree navigation                                 #
+#---------------------------------------------------#
+
+def _navigate(node, builder, visit = None):
+    '''
+    Walks the children of `node` in preorder and reports them to `builder`.
+
+    A subtree is closed once its children have been walked if it ends where
+    its parent ends; a close without an open subtree is skipped with a
+    'Nothing to close' warning, which Python shows once by default.
+
+    The walk uses an explicit stack, so the depth of the tree is not
+    limited by Python's recursion limit.
+
+    If `visit` is given, it is called once on every element that is walked.
+    '''
+
+    # Number of subtrees opened and not closed yet
+    to_close = 0
+
+    # (children left to walk, end of their parent, end of the parent's parent);
+    # the parent's parent of `node` itself is never compared
+    stack = [(iter(node), get_span(node)[1], None)]
+
+    while stack:
+        children, parent_end, grandparent_end = stack[-1]
+        child = next(children, None)
+
+        if child is None:
+            stack.pop()
+
+            if stack and grandparent_end == parent_end:
+                if to_close:
+                    to_close -= 1
+                    builder.close()
+                else:
+                    warnings.warn('Nothing to close: a subtree end was found without an open subtree', stacklevel = 2)
+
+            continue
+
+        if visit is not None:
+            visit(child)
+
+        if is_subtree(child):
+            builder.open(get_label(child))
+            to_close += 1
+
+        if is_leaf(child):
+            builder.leaf(child.get('rel')) # To change to rel when function is finished
+
+        stack.append((iter(child), get_span(child)[1], parent_end))
+
+    return builder
+
+
+def _top_nodes(tree):
     try:
-        node = tree.getroot().findall('node')
+        return tree.getroot().findall('node')
 
     except AttributeError:
-        node = tree
+        return tree
+
+def tree_to_brackets(tree:ET.Element, structure = False):
+    '''
+    Returns str -> the tree in bracket notation.
+
+    If structure is True:
+
+    Returns tuple -> (bracket notation, list with the label of every node
+    in preorder, list with the position of every node's parent in that
+    list, -1 for a root)
+    '''
+
+    builder = StructureBuilder() if structure else BracketBuilder()
+
+    return _navigate(_top_nodes(tree), builder).result()
+
+def tree_to_apted(tree:ET.Element):
+    '''
+    Returns apted.helpers.Tree -> the same tree as
+    `Tree.from_text(tree_to_brackets(tree))`, built without the bracket string.
+    '''
+
+    return _navigate(_top_nodes(tree), TreeBuilder()).result()
 
+#---------------------------------------------------#
+#   Sentence visitor                                #
+#---------------------------------------------------#
 
-    def get_degree(node):
-        degree = len(node)
-        return degree
+SentenceRecord = namedtuple('SentenceRecord', [
+    'n_vp',
+    'n_np',
+    'n_pp',
+    'n_nodes',
+    'words_before_main_verb',
+    'tree',
+    'summary'
+    ])
 
-    def is_internal(node):
-        if get_degree(node) >= 1:
-            return True
-        else:
-            return False
+def get_words_before_main_verb(words, nodes):
+    '''
+    Counts the number of words before each finite main verb of the sentence.
 
-    def is_leaf(node):
-        if is_internal(node) == False:
-            return True
-        else:
-            return False
+    words = list with the words of the sentence
+    nodes = list with all <node> elements of the sentence in document order
 
-    def is_subtree(node):
-        if node.get('cat')is not None:
-            return True
-        else:
-            return False
+    The count is reset at the start of every main clause conjunct.
 
-    def wrap(leaf):
-        wrapped = str('{' + leaf + '}')
-        return wrapped
+    The nodes are first indexed by their `begin` position, keeping only the
+    main clause conjuncts and the nodes with a word, so that every word is
+    only compared with the nodes that start at its position.
 
-    def open_wrap(node):
-        bracket = '{'
-        name = node.get('cat')
-        if name.startswith('mwu'):
-            name = 'mwu'
-        return str(bracket + name)
+    Returns a list with one count for each finite main verb.
+    '''
+    starting_at = {}
 
-    def close_wrap():
-        bracket = '}'
-        return bracket
+    for element in nodes:
+        begin = element.get('begin')
 
-    def get_span(node):
-        if isinstance(node, ET.Element):
-            begin = node.get('begin')
-            end = node.get('end')
+        if begin is None:
+            continue
 
-        else:
-            begin = None
-            end = None
+        resets = element.get('cat') == 'smain' and element.get('rel') in ('cnj', 'dp')
 
-        return begin, end
+        if resets or element.get('word') is not None:
+            starting_at.setdefault(int(begin), []).append((resets, element))
 
+    cnt = 0
+    multiple = []
 
-    to_close = []
+    for order, word in enumerate(words):
 
-    def _recursive_navigation(node, _descendants=None):
+        for resets, element in starting_at.get(order, ()):
 
-        if _descendants is None:
-            _descendants = []
+            if resets:
+                cnt = 0
 
-        else:
-            if is_subtree(node):
-                level = open_wrap(node)
-                _descendants.append(level)
-                to_close.append('')
+            if element.get('word') == word:
+                if element.get('wvorm') == 'pv' and (element.get('lcat') == 'smain' or element.get('lcat') == 'sv1'):
+                    multiple.append(cnt)
+                cnt += 1
 
+    return multiple
 
-            if is_leaf(node):
+def visit_sentence(tree):
+    '''
+    Walks the Alpino tree of one sentence once and collects everything the
+    Alpino-based features need from it.
 
-                leaf = wrap(node.get('rel')) # To change to rel when function is finished
-                _descendants.append(leaf)
+    Requires tree to be an ElementTree, see `read_alpino`.
 
+    Returns SentenceRecord with:
+        n_vp, n_np, n_pp -> number of VPs, NPs and PPs
+        n_nodes -> number of nodes with a <node lcat> attribute
+        words_before_main_verb -> list, see `get_words_before_main_verb`
+        tree -> the sentence's apted.helpers.Tree, see `tree_to_apted`
+        summary -> the tree's `ted.TreeSummary`, shared by every TED of the
+                   sentence
+    '''
+    nodes = []
+    counts = {'vp': 0, 'np': 0, 'pp': 0, 'nodes': 0}
 
-        for child in node:
+    def visit(element):
+        if element.tag != 'node':
+            return
 
+        nodes.append(element)
 
-            parent_begin, parent_end = get_span(node)
-            child_begin, child_end = get_span(child)
+        lcat = element.get('lcat')
 
-            _recursive_navigation(child, _descendants)
+        if lcat:
+            counts['nodes'] += 1
 
-            if parent_end == child_end:
-                try:
-                    to_close.pop()
-                    _descendants.append(close_wrap())
-                except IndexError:
-                    print('Nothing to close')
+        if element.get('pos') == 'verb' and element.get('rel') == 'hd':
+            counts['vp'] += 1
 
+        if lcat == 'np':
+            counts['np'] += 1
 
-        return(_descendants)
+        if lcat == 'pp':
+            counts['pp'] += 1
 
+    apted_tree = _navigate(_top_nodes(tree), TreeBuilder(), visit).result()
 
+    words = tree.getroot().find('sentence').text.split(' ')
 
-    return ''.join(_recursive_navigation(node))
+    return SentenceRecord(
+        counts['vp'],
+        counts['np'],
+        counts['pp'],
+        counts['nodes'],
+        get_words_before_main_verb(words, nodes),
+        apted_tree,
+        TreeSummary(apted_tree)
+        )
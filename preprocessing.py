@@ -4,19 +4,93 @@ import os
 import pandas as pd
 import regex as re
 import numpy as np
-import stanza
 import sys
+import multiprocessing
+from functools import partial
 from string import punctuation
+from utils import pop_option
 
 #---------------------------------------------------#
-#   Load Stanza model                               #
+#   Load Stanza model.                              #
+#                                                   #
+#   Stanza and its Dutch pipelines are only loaded  #
+#   the first time a Stanza-based step runs, and    #
+#   the model is never downloaded automatically.    #
+#                                                   #
 #---------------------------------------------------#
 
-try:
-    nlp = stanza.Pipeline(lang='nl', processors='tokenize, ner')
-except:
-    stanza.download('nl')
-    nlp = stanza.Pipeline(lang='nl', processors='tokenize, ner')
+nlp = None
+
+# Tokenize-only pipeline, see `get_tokenizer`
+tokenizer = None
+
+# Directory with Stanza's models, Stanza's default directory if None
+model_dir = None
+
+def set_model_dir(path):
+    '''
+    Sets the directory the Stanza pipelines are loaded from. Has no effect
+    on the pipelines that have already been loaded.
+    '''
+    global model_dir
+    model_dir = path
+
+class ModelNotFoundError(RuntimeError):
+    '''
+    Stanza's Dutch model could not be loaded.
+
+    A regular exception, so that it also reaches the parent process when
+    the pipeline is loaded by a pool worker; `main` turns it into the
+    script's exit message.
+    '''
+
+
+def load_pipeline(processors):
+    '''
+    Returns stanza.Pipeline -> a Dutch pipeline with the given processors,
+    loaded from `model_dir`.
+
+    Raises ModelNotFoundError with download instructions if the model is
+    missing.
+    '''
+    import stanza
+
+    options = {} if model_dir is None else {'dir': model_dir}
+
+    try:
+        return stanza.Pipeline(lang='nl', processors=processors, download_method = None, **options)
+    except FileNotFoundError as error:
+        raise ModelNotFoundError(f'''
+        Stanza's Dutch model could not be loaded: {error}
+
+        Download it once with `python -c "import stanza; stanza.download('nl')"`
+        or point to an existing copy with --model-dir.
+        ''') from error
+
+def get_nlp():
+    '''
+    Returns stanza.Pipeline -> the Dutch tokenize and NER pipeline, loaded
+    on the first call and shared afterwards, see `load_pipeline`.
+    '''
+    global nlp
+
+    if nlp is None:
+        nlp = load_pipeline('tokenize, ner')
+
+    return nlp
+
+def get_tokenizer():
+    '''
+    Returns stanza.Pipeline -> the Dutch tokenize pipeline, for texts whose
+    sentences are needed but not their named entities. Loaded on the first
+    call and shared afterwards, see `load_pipeline`.
+    '''
+    global tokenizer
+
+    if tokenizer is None:
+        tokenizer = load_pipeline('tokenize')
+
+    return tokenizer
 
 #---------------------------------------------------#
 #   Preprocessing functions definition to fit       #
@@ -24,16 +98,26 @@ except:
 #---------------------------------------------------#
 
 
+# Patterns shared by the rule-based preprocessing steps and `normalise_text`
+bracket_table = str.maketrans('[]', '()')
+
+# The sentence limit is always replaced by a single space, so the pattern has
+# no groups and the replacement is a plain string
+sentence_limit_pattern = re.compile(r'(?<=[a-z])\s?[.?!;]*(?<! )(?=[A-Z]|$)')
+
+capitalize_patterns = [
+    re.compile(r'(((?<=[a-z])(\.|\?|\!\;) *)([a-z]))'),
+    re.compile(r'(^[a-z])'),
+    re.compile(r'(?<=[a-z]\.|\?|\!\;)([a-z])')
+    ]
+
+numbering_pattern = re.compile(r'^\d[\.|\-]\s?')
+
 def replace_parenthesis(text):
     '''
     Replaces all squared brackets with round brackets.
     '''
-    for char in text:
-        if char == '[':
-            text = text.replace('[', '(')
-        if char ==']':
-            text = text.replace(']', ')')
-    return text
+    return text.translate(bracket_table)
 
 
 def sentence_limit_fix(text):
@@ -43,14 +127,23 @@ def sentence_limit_fix(text):
 
     Requires properly capitalized sentences.
     '''
-    pattern = re.compile(r'(?<=[a-z])(\s)?(\.|\?|\!|\;)*(?<! )((?=[A-Z])|($))')
+    corrected = sentence_limit_pattern.sub(' ', text)
+    return corrected
 
-    def get_punctuation(match):
-        return match.group(3) + ' '
 
-    corrected = re.sub(pattern, get_punctuation, text)
-    return corrected
+def capitalize(match):
+    return match.group(1).upper()
 
+def capitalize_line(line):
+    '''
+    Capitalizes the sentences of a single line, see `capitalize_sentences`.
+    '''
+    corrected_line = line.strip()
+
+    for pattern in capitalize_patterns:
+        corrected_line = pattern.sub(capitalize, corrected_line)
+
+    return corrected_line
 
 def capitalize_sentences(text):
     '''
@@ -59,21 +152,7 @@ def capitalize_sentences(text):
     to delimite sentences, but no upper-case is use to start
     a new sentence..
     '''
-    pattern = re.compile(r'(((?<=[a-z])(\.|\?|\!\;) *)([a-z]))')
-    pattern2 = re.compile(r'(^[a-z])')
-    pattern3 = re.compile(r'(?<=[a-z]\.|\?|\!\;)([a-z])')
-
-
-    def capitalize(match):
-        return match.group(1).upper()
-
-    corrected_text = []
-
-    for line in text.split('\n'):
-        corrected_line = re.sub(pattern, capitalize, line.strip())
-        corrected_line = re.sub(pattern2, capitalize, corrected_line.strip())
-        corrected_line = re.sub(pattern3, capitalize, corrected_line.strip())
-        corrected_text.append(corrected_line)
+    corrected_text = [capitalize_line(line) for line in text.split('\n')]
 
     corrected = '\n'.join(corrected_text)
 
@@ -84,18 +163,46 @@ def remove_numbering(text):
     Removes the sentence numbers added by the author to count the amount
     of sentences written.
     '''
-    pattern = re.compile(r'^\d[\.|\-]\s?')
-
-    corrected_text = []
-    for line in text.split('\n'):
-        corrected_line = re.sub(pattern, '', line)
-        corrected_text.append(corrected_line)
+    corrected_text = [numbering_pattern.sub('', line) for line in text.split('\n')]
 
     corrected = '\n'.join(corrected_text)
     return corrected
 
 
-def check_ner(text):
+def normalise_text(text):
+    '''
+    Applies `replace_parenthesis`, `sentence_limit_fix`,
+    `capitalize_sentences` and `remove_numbering` one after the other.
+    The last two work line by line, so the text is only split in lines
+    once for both of them.
+    '''
+    text = sentence_limit_fix(text.translate(bracket_table))
+
+    return '\n'.join(numbering_pattern.sub('', capitalize_line(line)) for line in text.split('\n'))
+
+
+def annotate(texts, batch_size = 32, pipeline = None):
+    '''
+    Runs the Stanza pipeline on every text, `batch_size` texts at a time,
+    so that Stanza can batch its tokenisation and NER over several texts.
+
+    pipeline = function returning the pipeline to run, `get_nlp` by default
+
+    Returns list of stanza.Document -> one for each text, in the same order.
+    '''
+    from stanza import Document
+
+    pipeline = pipeline or get_nlp
+    docs = []
+
+    for start in range(0, len(texts), batch_size):
+        batch = [Document([], text = text) for text in texts[start:start + batch_size]]
+        docs.extend(pipeline()(batch))
+
+    return docs
+
+
+def check_ner(text, doc = None):
     '''
     Corrects words that are "incorrectly" capitalized.
 
@@ -103,22 +210,19 @@ def check_ner(text):
     sentence and is not recognized as a named entity, it will
     be replaced by a lowercase version.
 
+    doc = Stanza's annotation of the text, computed if not given
+
     '''
 
-    doc = nlp(text)
+    if doc is None:
+        doc = get_nlp()(text)
+
     l_doc = text.split(' ')
 
     pattern = re.compile(r'(?<=[\.|!|?] |^)([A-Z]\w*)')
 
-    def check_start_sentence(tok):
-        '''
-        Controls that the capitalized word starts a new sentence.
-        '''
-        sentence_starters = re.findall(pattern, text)
-        if tok in sentence_starters:
-            return True
-        else:
-            return False
+    # Capitalized words that start a new sentence
+    sentence_starters = set(re.findall(pattern, text))
 
     def check_end_punct(tok):
         '''
@@ -150,44 +254,47 @@ def check_ner(text):
 
     parsed = [t for sent in doc.sentences for t in sent.tokens if t.text not in punctuation]
 
-
-    for i, tok in enumerate(l_doc):
+    # The i-th untokenized word is aligned with the i-th tokenized word that
+    # is not punctuation; both lists are walked together once.
+    for i, (tok, token) in enumerate(zip(l_doc, parsed)):
         if check_end_punct(tok):
             w = tok[:-1]
         else:
             w = tok
 
-        for token_i, token in enumerate(parsed):
-            # Checking for match between tokenized and untokenized version
-            if token.text == w:
-                # Checking for match between the position of the tokenized
-                # and the untokenized version
-                if i == token_i:
-                    # Checking whether the token is capitalized, whether it
-                    # starts a sentence and whether it's a named entity. If it
-                    # is not, the token becomes lowercased.
+        # Checking for match between tokenized and untokenized version
+        if token.text == w:
+            # Checking whether the token is capitalized, whether it
+            # starts a sentence and whether it's a named entity. If it
+            # is not, the token becomes lowercased.
 
-                    if check_upper(tok) and not check_start_sentence(tok) and not check_is_ent(token):
-                            l_doc[i] = tok.lower()
-                    break
+            if check_upper(tok) and tok not in sentence_starters and not check_is_ent(token):
+                l_doc[i] = tok.lower()
 
     corrected = ' '.join(l_doc)
     return corrected
 
 
-def split_sentences(text):
+def split_sentences(text, doc = None):
     '''
     Fixes formatting for parsing with Alpino by splitting sentences in such
     a way that every setence equals to one line. Adds a period to sentences
     missing a final punctuation.
+
+    doc = Stanza's annotation of the text, computed if not given; the
+          sentences are read from `text` through its character offsets
     '''
 
-    doc = nlp(text)
+    if doc is None:
+        doc = get_nlp()(text)
+
     split_text = ''
 
+    sentences = [text[sentence.tokens[0].start_char:sentence.tokens[-1].end_char] for sentence in doc.sentences]
+
     def check_next_lower(i):
         try:
-            next_sentence = doc.sentences[i + 1].text
+            next_sentence = sentences[i + 1]
 
             if next_sentence[0].islower():
                 return True
@@ -198,8 +305,7 @@ def split_sentences(text):
             return False
 
 
-    for i, sentence in enumerate(doc.sentences):
-        s = sentence.text
+    for i, s in enumerate(sentences):
 
         if check_next_lower(i):
             split_text += s + ' '
@@ -227,101 +333,234 @@ def split_sentences(text):
     return split_text
 
 
-def apply_preprocessing(dataset):
+def reuse_annotation(doc, text):
+    '''
+    Checks whether Stanza's annotation `doc` still holds for `text`, the
+    output of `check_ner` on the annotated text.
+
+    Stanza's tokeniser is case-sensitive, so lowercasing a single word can
+    move or add a sentence boundary anywhere in the text. The annotation is
+    only reused when `check_ner` left the text unchanged.
+
+    Returns stanza.Document -> `doc` if it holds, None if `text` has to be
+    annotated again.
+    '''
+    if text != doc.text:
+        return None
+
+    return doc
+
+
+def apply_stanza_preprocessing(texts, batch_size = 32):
+    '''
+    Applies `check_ner` and `split_sentences` to every text.
+
+    Every text is annotated once, in batches, and its annotation is shared
+    by both steps. The texts changed by the capitalisation fix are
+    tokenised again, see `reuse_annotation`; only their sentences are
+    needed, so they are not run through NER a second time.
+
+    Returns list with the preprocessed texts, in the same order.
+    '''
+    docs = annotate(texts, batch_size)
+
+    corrected = [check_ner(text, doc) for text, doc in zip(texts, docs)]
+    docs = [reuse_annotation(doc, text) for text, doc in zip(corrected, docs)]
+
+    changed = [i for i, doc in enumerate(docs) if doc is None]
+
+    for i, doc in zip(changed, annotate([corrected[i] for i in changed], batch_size, get_tokenizer)):
+        docs[i] = doc
+
+    return [split_sentences(text, doc) for text, doc in zip(corrected, docs)]
+
+
+def preprocess_texts(texts, batch_size = 32):
+    '''
+    Applies every preprocessing step to a list of texts.
+
+    The rule-based steps are applied by `normalise_text`,
+    and the Stanza-based steps after them, see `apply_stanza_preprocessing`.
+
+    Returns list with the preprocessed texts, in the same order.
+    '''
+    return apply_stanza_preprocessing([normalise_text(text) for text in texts], batch_size)
+
+
+def apply_preprocessing(dataset, batch_size = 32, pool = None):
     '''
     Apply preprocessing functions on the dataset
+
+    If a multiprocessing pool is given, the texts are split in shards of
+    `batch_size` texts that are preprocessed by its workers, and put back
+    together in their original order.
     '''
-    actions = [
-               replace_parenthesis,
-                sentence_limit_fix,
-                capitalize_sentences,
-                remove_numbering,
-                check_ner,
-                split_sentences,
-                ]
+    texts = dataset.TypedText.tolist()
+
+    if pool is None:
+        dataset['TypedText'] = preprocess_texts(texts, batch_size)
+        return
+
+    shards = [texts[start:start + batch_size] for start in range(0, len(texts), batch_size)]
+    preprocessed = pool.map(partial(preprocess_texts, batch_size = batch_size), shards, chunksize = 1)
 
-    for action in actions:
-        dataset['TypedText'] = dataset.TypedText.apply(action)
+    dataset['TypedText'] = [text for shard in preprocessed for text in shard]
 
 #---------------------------------------------------#
 #   File generation                                 #
 #---------------------------------------------------#
 
 
-def generate_txt(dataset, dataset_label):
+def generate_txt(dataset, dataset_label, append = False):
     '''
     Generates a *.txt file with the texts preprocessed
     for analysis with T-scan.
+
+    If `append` is True, the texts are added to the existing file.
     '''
-    with open(f'dataset{dataset_label}.txt', 'w', encoding = 'utf-8') as f:
+    with open(f'dataset{dataset_label}.txt', 'a' if append else 'w', encoding = 'utf-8') as f:
         for text in dataset['TypedText']:
             f.write(f'{text}\n\n')
 
-def generate_html_txt(dataset, dataset_label):
-    '''
-    Generates a *_html.txt file with the preprocessed texts, their corresponding
-    code and a html line-break.
+def html_lines(dataset, dataset_label, start = 0):
     '''
+    Yields the line of every text in the *_html.txt file, in one pass over
+    the dataset: its code, a tab and the text with html line-breaks.
 
-    file_n = 0
-
-    def replace_end_line(text):
-        pattern = re.compile(r'(\n)')
-        replaced = re.sub(pattern, '<br>', text)
-        return replaced
+    The code is the last character of the dataset label, the text number
+    and the row's index in the dataset.
 
+    start = number of the first text in `dataset`
+    '''
+    try:
+        dataset_n = dataset_label[-1]
+    except IndexError:
+        dataset_n = '0'
 
-    dataset['TypedText'] = dataset.TypedText.apply(replace_end_line)
-
+    for file_n, (part_n, text) in enumerate(zip(dataset.index, dataset['TypedText']), start):
+        html_text = text.replace('\n', '<br>')
+        yield f'{dataset_n}{file_n:03d}{part_n:03d}\t{html_text}\n'
 
-    with open(f'dataset{dataset_label}_html.txt', 'w', encoding = 'utf-8') as f:
-        for text in dataset['TypedText']:
-            part_n = dataset[dataset['TypedText']==text].index.values[0]
-            part_n = f'{part_n:03d}'
-            file_n_ = f'{file_n:03d}'
+def generate_html_txt(dataset, dataset_label, start = 0, append = False, buffer_size = 1 << 20):
+    '''
+    Generates a *_html.txt file with the preprocessed texts, their corresponding
+    code and a html line-break, see `html_lines`.
 
-            try:
-                dataset_n = dataset_label[-1]
-            except IndexError:
-                dataset_n = '0'
+    start = number of the first text in `dataset`
+    append = add the texts to the existing file
+    buffer_size = size in bytes of the write buffer
+    '''
 
-            f.write(f'{dataset_n}{file_n_}{part_n}\t{text}\n')
-            file_n += 1
+    with open(f'dataset{dataset_label}_html.txt', 'a' if append else 'w', encoding = 'utf-8', buffering = buffer_size) as f:
+        f.writelines(html_lines(dataset, dataset_label, start))
 
-def split_text_files(dataset, dataset_label):
+def split_text_files(dataset, dataset_label, start = 0):
     '''
     Generates an individual *.txt file for every preprocessed
     text for analysis with T-scan.
+
+    start = number of the first text in `dataset`
     '''
     try:
         os.mkdir(f'preprocessed{dataset_label}')
     except FileExistsError:
         pass
 
-    cnt = 0
+    cnt = start
     for text in dataset['TypedText']:
         with open(f'preprocessed{dataset_label}/text_{cnt}.txt', 'w', encoding = 'utf-8') as f:
             f.write(text)
         cnt += 1
 
-def generate_csv(dataset, dataset_label):
+def generate_csv(dataset, dataset_label, append = False):
     '''
     Generates a *.csv file with the texts preprocessed
     for analysis with T-scan, their corresponding evaluation
     and the participants' ID.
+
+    If `append` is True, the rows are added to the existing file.
+    '''
+    dataset.to_csv(f'dataset{dataset_label}.csv', sep = ',', mode = 'a' if append else 'w', header = not append)
+
+
+def preprocess_dataset(filename, dataset_label, html = False, batch_size = 32, chunksize = None, workers = 1):
+    '''
+    Preprocesses the raw dataset and generates every output file.
+
+    If more than one worker is requested, the texts are preprocessed by a
+    pool of `workers` processes, each with its own Stanza pipeline; see
+    `apply_preprocessing`. The processes are started with the 'spawn'
+    method, since the pipeline's models cannot be shared with forked ones,
+    and load the pipeline from the same `model_dir`.
+
+    If `chunksize` is given, the dataset is read, preprocessed and written
+    `chunksize` rows at a time, so that only one chunk is held in memory.
+    The texts are numbered across chunks in the order of the dataset, and
+    the output of every chunk is appended to the files as soon as it is
+    ready.
     '''
-    dataset.to_csv(f'dataset{dataset_label}.csv', sep = ',')
+
+    if chunksize is None:
+        chunks = [pd.read_csv(filename, sep = ';', index_col = 0)]
+    else:
+        chunks = pd.read_csv(filename, sep = ';', index_col = 0, chunksize = chunksize)
+
+    pool = multiprocessing.get_context('spawn').Pool(workers, initializer = set_model_dir, initargs = (model_dir,)) if workers > 1 else None
+
+    start = 0
+
+    try:
+        for data in chunks:
+            data = data['typedText'].to_frame(name = 'TypedText')
+            data['Evaluation'] = np.nan
+
+            append = start > 0
+
+            apply_preprocessing(data, batch_size, pool)
+            generate_csv(data, dataset_label, append)
+            generate_txt(data, dataset_label, append)
+            split_text_files(data, dataset_label, start)
+
+            if html:
+                generate_html_txt(data, dataset_label, start, append)
+
+            start += len(data)
+
+    finally:
+        if pool is not None:
+            pool.close()
+            pool.join()
 
 
 #---------------------------------------------------#
 #   main() definition                               #
 #---------------------------------------------------#
 
-USAGE = f"Usage: python {sys.argv[0]} [--help | -h] | [<dataset filename> <dataset label> <html>]"
+USAGE = f"Usage: python {sys.argv[0]} [--help | -h] | [<dataset filename> <dataset label> <html> [--batch-size N] [--chunksize N] [--workers N] [--model-dir path]]"
 
 def main():
     html = False
 
+    batch_size = pop_option(sys.argv, '--batch-size', default = 32, cast = int)
+
+    if batch_size < 1:
+        print('The batch size must be at least 1')
+        raise SystemExit(USAGE)
+
+    chunksize = pop_option(sys.argv, '--chunksize', default = None, cast = int)
+
+    if chunksize is not None and chunksize < 1:
+        print('The chunk size must be at least 1')
+        raise SystemExit(USAGE)
+
+    workers = pop_option(sys.argv, '--workers', default = 1, cast = int)
+
+    if workers < 1:
+        print('The number of workers must be at least 1')
+        raise SystemExit(USAGE)
+
+    set_model_dir(pop_option(sys.argv, '--model-dir', default = None))
+
     if len(sys.argv) == 4:
         if sys.argv[1] in os.listdir():
             script, filename, dataset_label = sys.argv[:-1]
@@ -359,6 +598,22 @@ def main():
             An optional second argument can be used to keep multiple outputs separated.
             Not specifying a label can lead to overwriting files.
 
+            The option --batch-size N sets how many texts Stanza processes
+            at once (default: 32).
+
+            The option --chunksize N reads and preprocesses the dataset N
+            rows at a time and appends every chunk to the output files, so
+            that large datasets do not have to fit in memory.
+
+            The option --workers N preprocesses the texts in N processes,
+            each loading its own Stanza pipeline. The output is the same
+            as with a single process.
+
+            Stanza's Dutch model is loaded from Stanza's default directory,
+            or from the directory given with --model-dir path. It is never
+            downloaded automatically; download it once with
+            python -c "import stanza; stanza.download('nl')"
+
             e.g. python {script} dataset.csv v1
             ''')
             sys.exit()
@@ -376,17 +631,10 @@ def main():
     #   formatting requirements.                        #
     #---------------------------------------------------#
 
-    data = pd.read_csv(filename, sep = ';', index_col = 0)
-    data = data['typedText'].to_frame(name = 'TypedText')
-    data['Evaluation'] = np.nan
-
-    apply_preprocessing(data)
-    generate_csv(data, dataset_label)
-    generate_txt(data, dataset_label)
-    split_text_files(data, dataset_label)
-
-    if html:
-        generate_html_txt(data, dataset_label)
+    try:
+        preprocess_dataset(filename, dataset_label, html, batch_size, chunksize, workers)
+    except ModelNotFoundError as error:
+        raise SystemExit(str(error))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,758 @@
+#!/usr/bin/env python3
+
+import os
+import json
+import hashlib
+import numpy as np
+from collections import Counter, OrderedDict
+from apted import APTED
+
+#---------------------------------------------------#
+#   Array-backed trees.                             #
+#                                                   #
+#   Alternative to APTED's object trees: every tree #
+#   is stored as flat postorder arrays and compared #
+#   with Zhang and Shasha's algorithm, filling each #
+#   row of the forest distance table at once with   #
+#   NumPy instead of cell by cell.                  #
+#                                                   #
+#---------------------------------------------------#
+
+# Integer id of every node label seen so far, and the label of every id
+label_ids = {}
+label_names = []
+
+class ArrayTree:
+    '''
+    Postorder array representation of a tree. Nodes are numbered 1..size
+    in left-to-right postorder; index 0 of every array is unused.
+
+    labels = label id of each node
+    lld = leftmost leaf descendant of each node
+    keyroots = nodes that have no ancestor with the same leftmost leaf,
+               in increasing order
+
+    The column layout used when the tree is the second tree of
+    `array_ted` is built on first use and kept for later pairs.
+    '''
+    __slots__ = ('size', 'labels', 'lld', 'keyroots', 'keyroot_sizes', '_layout')
+
+    def __init__(self, labels, lld):
+        self.size = len(labels) - 1
+        self.labels = np.asarray(labels, dtype = np.int64)
+        self.lld = np.asarray(lld, dtype = np.int64)
+
+        highest = {}
+        for node in range(1, self.size + 1):
+            highest[lld[node]] = node
+
+        self.keyroots = sorted(highest.values())
+        self.keyroot_sizes = sum(node - lld[node] + 1 for node in self.keyroots)
+        self._layout = None
+
+    @classmethod
+    def from_tree(cls, tree):
+        '''
+        Returns ArrayTree -> flat version of an apted.helpers.Tree
+        '''
+        if isinstance(tree, cls):
+            return tree
+
+        labels = [0]
+        lld = [0]
+
+        # Iterative postorder; `leftmost` holds the first leaf found under
+        # every node on the current path
+        stack = [(tree, False)]
+        leftmost = []
+
+        while stack:
+            node, visited = stack.pop()
+
+            if not visited:
+                stack.append((node, True))
+                leftmost.append(None)
+                for child in reversed(node.children):
+                    stack.append((child, False))
+                continue
+
+            number = len(labels)
+            first_leaf = leftmost.pop()
+
+            if first_leaf is None:
+                first_leaf = number
+
+            if leftmost and leftmost[-1] is None:
+                leftmost[-1] = first_leaf
+
+            if node.name not in label_ids:
+                label_ids[node.name] = len(label_names)
+                label_names.append(node.name)
+
+            labels.append(label_ids[node.name])
+            lld.append(first_leaf)
+
+        return cls(labels, lld)
+
+    def bracket(self):
+        '''
+        Returns str -> the tree in the bracket notation of
+        `apted.helpers.Tree.bracket`.
+        '''
+        # (first node of subtree, bracket notation of subtree) in postorder
+        stack = []
+
+        for node in range(1, self.size + 1):
+            first = self.lld[node]
+            children = []
+
+            while stack and stack[-1][0] >= first:
+                children.append(stack.pop()[1])
+
+            children.reverse()
+            stack.append((first, '{' + str(label_names[self.labels[node]]) + ''.join(children) + '}'))
+
+        return stack[0][1]
+
+    def heights(self):
+        '''
+        Returns dict -> {keyroot: nesting height}, where a keyroot has
+        height 0 if its subtree contains no other keyroot.
+        '''
+        heights = {}
+
+        for k in self.keyroots:
+            inner = [heights[other] for other in self.keyroots if self.lld[k] <= other < k]
+            heights[k] = max(inner) + 1 if inner else 0
+
+        return heights
+
+    def layout(self):
+        '''
+        Column layout of the forest distance tables of all keyroots, placed
+        side by side and grouped by keyroot height.
+
+        Every keyroot k gets a segment of k - lld[k] + 2 columns: the empty
+        forest followed by the nodes lld[k]..k. A keyroot only depends on
+        keyroots nested inside it, so all segments of a group can be filled
+        at once once the lower groups are done.
+        '''
+        if self._layout is not None:
+            return self._layout
+
+        heights = self.heights()
+
+        steps, segments, groups = [], [], []
+        width = 0
+        n_segments = 0
+
+        for height in sorted(set(heights.values())):
+            group_start = width
+            starts, positions, nodes, gather, on_path = [], [], [], [], []
+
+            for k in self.keyroots:
+                if heights[k] != height:
+                    continue
+
+                j0 = int(self.lld[k])
+                segment = width
+                starts.append(segment - group_start)
+
+                steps.extend(range(k - j0 + 2))
+                segments.extend([n_segments] * (k - j0 + 2))
+                n_segments += 1
+
+                for j in range(j0, k + 1):
+                    positions.append(segment + j - j0 + 1)
+                    nodes.append(j)
+                    gather.append(segment + int(self.lld[j]) - j0)
+                    on_path.append(int(self.lld[j]) == j0)
+
+                width += k - j0 + 2
+
+            positions = np.array(positions, dtype = np.int64)
+            nodes = np.array(nodes, dtype = np.int64)
+
+            groups.append((
+                slice(group_start, width),
+                np.array(starts, dtype = np.int64),
+                positions,
+                positions - group_start,
+                nodes,
+                np.array(gather, dtype = np.int64),
+                np.array(on_path, dtype = bool),
+                self.labels[nodes]
+                ))
+
+        self._layout = (width, np.array(steps, dtype = np.int64), np.array(segments, dtype = np.int64), groups)
+        return self._layout
+
+    def cost(self, other):
+        '''
+        Number of row operations `array_ted(self, other)` performs.
+        '''
+        return self.keyroot_sizes * len(other.layout()[3])
+
+
+def array_ted(tree1, tree2):
+    '''
+    Returns int -> TED between two ArrayTrees with unit costs, the same
+    value as APTED with its default configuration.
+
+    Zhang and Shasha's algorithm: for every keyroot of the first tree, the
+    forest distance tables against all keyroots of the second tree are
+    filled row by row. Each row of a group of keyroots of the same height
+    is computed at once with NumPy: deletions and renames are vectorised,
+    and the chain of insertions along the row is resolved with a running
+    minimum per keyroot segment.
+    '''
+    # TED is symmetric; put the tree that needs the fewest row operations first
+    if tree1.cost(tree2) > tree2.cost(tree1):
+        tree1, tree2 = tree2, tree1
+
+    labels1, lld1 = tree1.labels, tree1.lld
+    width, steps, segments, groups = tree2.layout()
+
+    treedist = np.zeros((tree1.size + 1, tree2.size + 1), dtype = np.int64)
+
+    # Separates the segments in the running minimum: later segments are
+    # shifted far enough down that earlier ones never carry over into them
+    shift = steps + segments * 4 * (tree1.size + tree2.size + 2)
+
+    for k1 in tree1.keyroots:
+        i0 = lld1[k1]
+
+        forestdist = np.empty((k1 - i0 + 2, width), dtype = np.int64)
+        forestdist[0] = steps
+
+        for i in range(i0, k1 + 1):
+            a = i - i0 + 1
+            previous = forestdist[a - 1]
+            current = forestdist[a]
+            offset = lld1[i] - i0
+
+            for columns, starts, positions, local, nodes, gather, on_path, labels in groups:
+                # Subtree pairs that were computed for earlier keyroot pairs
+                candidates = forestdist[offset, gather] + treedist[i, nodes]
+
+                if offset == 0:
+                    renames = previous[positions - 1] + (labels != labels1[i])
+                    candidates = np.where(on_path, renames, candidates)
+
+                row = current[columns]
+                row[starts] = a
+                row[local] = np.minimum(previous[positions] + 1, candidates)
+
+                row -= shift[columns]
+                np.minimum.accumulate(row, out = row)
+                row += shift[columns]
+
+                if offset == 0:
+                    treedist[i, nodes[on_path]] = row[local[on_path]]
+
+    return int(treedist[tree1.size, tree2.size])
+
+#---------------------------------------------------#
+#   Bounds and approximations.                      #
+#                                                   #
+#   Cheap lower and upper bounds on the TED. Their  #
+#   midpoint estimates the distances of texts that  #
+#   are too long to compare exactly.                #
+#                                                   #
+#---------------------------------------------------#
+
+class TreeSummary:
+    '''
+    Size, label multiset and canonical signature of a tree.
+
+    Two trees with the same signature have the same labels and structure,
+    so their TED is 0. The signature is the tree's bracket notation, so it
+    is the same for every kind of tree and in every run.
+
+    A tree that is compared many times can be summarised once and the
+    summary passed instead of the tree, see `summarise`.
+    '''
+    __slots__ = ('tree', 'size', 'labels', 'signature', '_hash')
+
+    def __init__(self, tree):
+        self.tree = tree
+
+        if isinstance(tree, ArrayTree):
+            self.size = tree.size
+            self.labels = Counter(label_names[label] for label in tree.labels[1:].tolist())
+            self.signature = tree.bracket()
+
+        else:
+            # Preorder walk with an explicit stack, as `Tree.bracket` recurses
+            # once per level; None closes the bracket of the node before it
+            labels = []
+            parts = []
+            stack = [tree]
+            while stack:
+                node = stack.pop()
+                if node is None:
+                    parts.append('}')
+                    continue
+                labels.append(node.name)
+                parts.append('{' + str(node.name))
+                stack.append(None)
+                stack.extend(reversed(node.children))
+
+            self.size = len(labels)
+            self.labels = Counter(labels)
+            self.signature = ''.join(parts)
+
+        self._hash = None
+
+    def tree_hash(self):
+        '''
+        Returns str -> stable hash of the signature, computed on first use.
+        '''
+        if self._hash is None:
+            self._hash = hashlib.blake2b(self.signature.encode('utf-8'), digest_size = 16).hexdigest()
+        return self._hash
+
+
+def summarise(tree):
+    '''
+    Returns TreeSummary -> the summary of a tree, or the tree itself if it
+    already is one.
+    '''
+    if isinstance(tree, TreeSummary):
+        return tree
+    return TreeSummary(tree)
+
+
+def lower_bound(summary1, summary2):
+    '''
+    Returns int -> lower bound on the TED from the label multisets.
+
+    Every edit operation changes the size difference or the number of
+    unmatched labels of the two trees by at most one, so the TED is at
+    least max(size1, size2) minus the number of labels they share. This
+    bound is never smaller than the size difference.
+    '''
+    shared = sum((summary1.labels & summary2.labels).values())
+    return max(summary1.size, summary2.size) - shared
+
+def top_down_distance(tree1, tree2):
+    '''
+    Returns int -> upper bound on the TED between two apted.helpers.Trees.
+
+    Only allows mappings in which the parents of mapped nodes are mapped
+    too (Selkow's top-down distance): the roots are renamed if needed and
+    their children lists are aligned like strings, deleting or inserting
+    whole subtrees. Any such script is a valid edit script, so the result
+    is never smaller than the TED, and it takes O(size1 x size2) steps.
+    '''
+    sizes = {}
+
+    def size(node):
+        if id(node) not in sizes:
+            sizes[id(node)] = 1 + sum(size(child) for child in node.children)
+        return sizes[id(node)]
+
+    def distance(node1, node2):
+        children1, children2 = node1.children, node2.children
+
+        previous = [0]
+        for child2 in children2:
+            previous.append(previous[-1] + size(child2))
+
+        for child1 in children1:
+            current = [previous[0] + size(child1)]
+            for j, child2 in enumerate(children2):
+                current.append(min(
+                    previous[j + 1] + size(child1),
+                    current[j] + size(child2),
+                    previous[j] + distance(child1, child2)
+                    ))
+            previous = current
+
+        return int(node1.name != node2.name) + previous[-1]
+
+    return distance(tree1, tree2)
+
+def approximate_ted(summary1, summary2):
+    '''
+    Returns float -> estimate of the TED between two summarised trees: the
+    middle of the label-multiset lower bound and the top-down upper bound.
+    '''
+    if summary1.signature == summary2.signature:
+        return 0.0
+
+    lower = lower_bound(summary1, summary2)
+    upper = top_down_distance(summary1.tree, summary2.tree)
+
+    return (lower + upper) / 2
+
+#---------------------------------------------------#
+#   TED backends                                    #
+#                                                   #
+#   A backend prepares each tree once and computes  #
+#   the distance between two prepared trees.        #
+#                                                   #
+#---------------------------------------------------#
+
+def compute_ted(tree1, tree2):
+    '''
+    Returns int -> TED between two apted.helpers.Trees.
+    '''
+    return APTED(tree1, tree2).compute_edit_distance()
+
+def keep_tree(tree):
+    return tree
+
+backends = {
+    'apted': (keep_tree, compute_ted),
+    'numpy': (ArrayTree.from_tree, array_ted),
+    }
+
+default_backend = 'apted'
+
+def set_backend(name):
+    '''
+    Sets the TED backend used when none is given, either `'apted'`
+    or `'numpy'`.
+    '''
+    global default_backend
+
+    if name not in backends:
+        raise ValueError(f'Unknown TED backend: {name}')
+
+    default_backend = name
+
+#---------------------------------------------------#
+#   Corpus-wide TED memo.                           #
+#                                                   #
+#   Learners' sentences are highly repetitive, and  #
+#   so are their trees. Exact distances are stored  #
+#   by the hashes of both trees, so a pair of trees #
+#   is never computed twice, within a text, across  #
+#   texts or, when saved to disk, across runs.      #
+#                                                   #
+#---------------------------------------------------#
+
+class TedMemo:
+    '''
+    Size-bounded LRU memo of exact TEDs, keyed by the unordered pair of
+    tree hashes (see `TreeSummary.tree_hash`).
+
+    max_entries = maximum number of distances kept; the least recently
+                  used ones are evicted first.
+    record_updates = if True, the entries added since the last call to
+                     `take_updates` are also kept aside, so that they can
+                     be handed to another memo with `merge`; this is how
+                     pool workers report back to the main process, which
+                     must call `take_updates` regularly.
+
+    Counts its hits and misses.
+    '''
+
+    def __init__(self, max_entries = 200000, record_updates = False):
+        self.max_entries = max_entries
+        self.record_updates = record_updates
+        self.hits = 0
+        self.misses = 0
+        self._distances = OrderedDict()
+        self._new = []
+        self._new_hits = 0
+        self._new_misses = 0
+
+    def __len__(self):
+        return len(self._distances)
+
+    @staticmethod
+    def key(hash1, hash2):
+        return (hash1, hash2) if hash1 <= hash2 else (hash2, hash1)
+
+    def get(self, hash1, hash2):
+        '''
+        Returns int -> the stored distance, or None if the pair is unknown.
+        '''
+        key = self.key(hash1, hash2)
+
+        if key in self._distances:
+            self._distances.move_to_end(key)
+            self.hits += 1
+            self._new_hits += 1
+            return self._distances[key]
+
+        self.misses += 1
+        self._new_misses += 1
+        return None
+
+    def put(self, hash1, hash2, distance):
+        key = self.key(hash1, hash2)
+
+        self._distances[key] = distance
+        self._distances.move_to_end(key)
+
+        if self.record_updates:
+            self._new.append((key[0], key[1], distance))
+
+        while len(self._distances) > self.max_entries:
+            self._distances.popitem(last = False)
+
+    def take_updates(self):
+        '''
+        Returns tuple -> (new entries, hits, misses) since the last call.
+        The entries are only recorded if `record_updates` is set.
+        '''
+        updates = (self._new, self._new_hits, self._new_misses)
+        self._new = []
+        self._new_hits = 0
+        self._new_misses = 0
+        return updates
+
+    def merge(self, updates):
+        '''
+        Adds the entries and counts returned by another memo's `take_updates`.
+        '''
+        entries, hits, misses = updates
+
+        for hash1, hash2, distance in entries:
+            self.put(hash1, hash2, distance)
+
+        self.hits += hits
+        self.misses += misses
+
+    def load(self, path):
+        '''
+        Adds the entries saved in `path` by `save`, if the file exists.
+        '''
+        if not os.path.exists(path):
+            return
+
+        with open(path, encoding = 'utf-8') as f:
+            entries = json.load(f)['entries']
+
+        for hash1, hash2, distance in entries:
+            self.put(hash1, hash2, distance)
+
+        self._new = []
+
+    def save(self, path):
+        '''
+        Writes every entry to `path` as json, least recently used first.
+        '''
+        entries = [[hash1, hash2, distance] for (hash1, hash2), distance in self._distances.items()]
+
+        with open(f'{path}.tmp', 'w', encoding = 'utf-8') as f:
+            json.dump({'entries': entries}, f)
+
+        os.replace(f'{path}.tmp', path)
+
+
+ted_memo = TedMemo()
+
+#---------------------------------------------------#
+#   Pairwise tree edit distance (TED).              #
+#                                                   #
+#   Distances are symmetric, so each unordered pair #
+#   of trees is only computed once and stored in    #
+#   the upper triangle of a distance matrix.        #
+#                                                   #
+#---------------------------------------------------#
+
+def all_pairs(n):
+    '''
+    Returns list with every unordered pair (i, j), i < j, of n items.
+    '''
+    return [(i, j) for i in range(n) for j in range(i + 1, n)]
+
+def upper_pairs(pairs):
+    '''
+    Normalises index pairs to (i, j) with i < j, dropping pairs of an item
+    with itself and repeated pairs while keeping the original order.
+    '''
+    seen = set()
+    normalised = []
+
+    for i, j in pairs:
+        if i == j:
+            continue
+
+        pair = (min(i, j), max(i, j))
+
+        if pair not in seen:
+            seen.add(pair)
+            normalised.append(pair)
+
+    return normalised
+
+def pairwise_ted(trees, pairs = None, mappings = False, backend = None, memo = True):
+    '''
+    Computes the TED between pairs of trees.
+
+    trees = list of apted.helpers.Tree, trees already prepared for the
+            backend, or their TreeSummary
+    pairs = list of index pairs (i, j) to compare. Defaults to every
+            unordered pair of trees.
+    backend = `'apted'` or `'numpy'`; defaults to the backend set with
+              `set_backend`.
+
+    Every unordered pair is computed once and every tree is only prepared
+    once for all pairs it takes part in. Pairs of identical trees are set
+    to 0 without being computed, and distances found in `ted_memo` are not
+    computed again unless `memo` is False. The edit mapping of a pair is
+    only computed when `mappings` is True, which requires the APTED backend.
+
+    Returns numpy array -> n x n upper-triangular distance matrix, where the
+    entries of pairs that were not requested are -1.
+
+    If mappings is True:
+    Returns tuple -> (distance matrix, {(i, j): edit mapping})
+    '''
+    backend = backend or default_backend
+
+    if backend not in backends:
+        raise ValueError(f'Unknown TED backend: {backend}')
+
+    if mappings and backend != 'apted':
+        raise ValueError('Edit mappings can only be computed with the APTED backend')
+
+    prepare, distance = backends[backend]
+
+    n = len(trees)
+
+    if pairs is None:
+        pairs = all_pairs(n)
+    else:
+        pairs = upper_pairs(pairs)
+
+    memo = memo and not mappings
+
+    summaries = [summarise(tree) for tree in trees]
+    trees = [tree.tree if isinstance(tree, TreeSummary) else tree for tree in trees]
+    hashes = [summary.tree_hash() for summary in summaries] if memo else None
+
+    # Trees are only prepared for the backend when a pair has to be computed
+    prepared = [None] * n
+
+    def get_prepared(i):
+        if prepared[i] is None:
+            prepared[i] = prepare(trees[i])
+        return prepared[i]
+
+    distances = np.full((n, n), -1, dtype = np.int64)
+    edit_mappings = {}
+
+    for i, j in pairs:
+        if mappings:
+            apted = APTED(get_prepared(i), get_prepared(j))
+            distances[i, j] = apted.compute_edit_distance()
+            edit_mappings[(i, j)] = apted.compute_edit_mapping()
+            continue
+
+        if summaries[i].signature == summaries[j].signature:
+            distances[i, j] = 0
+            continue
+
+        ted = ted_memo.get(hashes[i], hashes[j]) if memo else None
+
+        if ted is None:
+            ted = distance(get_prepared(i), get_prepared(j))
+
+            if memo:
+                ted_memo.put(hashes[i], hashes[j], ted)
+
+        distances[i, j] = ted
+
+    if mappings:
+        return distances, edit_mappings
+
+    return distances
+
+#---------------------------------------------------#
+#   Text-level TED with a budget.                   #
+#                                                   #
+#   The exact TED of every sentence pair grows      #
+#   with the square of the number of sentences and  #
+#   about the cube of their length. Texts whose     #
+#   exact work would exceed the budget, or every    #
+#   text in approximate mode, get estimates.        #
+#                                                   #
+#---------------------------------------------------#
+
+ted_modes = ('exact', 'approximate')
+
+default_mode = 'exact'
+default_budget = None
+
+def set_mode(mode, budget = None):
+    '''
+    Sets the TED mode used when none is given.
+
+    mode = `'exact'` or `'approximate'`
+    budget = maximum exact work per text, in compared node pairs (see
+             `ted_cost`); None for no limit. Only used in exact mode.
+    '''
+    global default_mode, default_budget
+
+    if mode not in ted_modes:
+        raise ValueError(f'Unknown TED mode: {mode}')
+
+    default_mode = mode
+    default_budget = budget
+
+def ted_cost(summaries, pairs = None):
+    '''
+    Returns int -> estimated exact TED work for the given pairs of
+    summarised trees, as the number of node pairs that are compared.
+    Defaults to every unordered pair.
+    '''
+    if pairs is None:
+        pairs = all_pairs(len(summaries))
+
+    return sum(summaries[i].size * summaries[j].size for i, j in pairs)
+
+def is_approximated(trees, mode = None, budget = None):
+    '''
+    Returns bool -> whether the TEDs between the sentences of a text are
+    estimated instead of computed exactly.
+
+    The budget is checked against every sentence pair of the text, so all
+    TED-based indices of a text are either exact or estimated.
+    '''
+    mode = mode or default_mode
+    budget = budget if budget is not None else default_budget
+
+    if mode == 'approximate':
+        return True
+
+    if budget is None:
+        return False
+
+    return ted_cost([summarise(tree) for tree in trees]) > budget
+
+def text_ted(trees, pairs = None, mode = None, budget = None, backend = None):
+    '''
+    Computes the TED between pairs of sentence trees of one text, exactly
+    or, if the text is approximated (see `is_approximated`), with
+    `approximate_ted`.
+
+    trees = see `pairwise_ted`; passing TreeSummaries avoids summarising the
+            trees again for every call
+
+    Returns tuple -> (distance matrix, approximated) where the matrix is the
+    one returned by `pairwise_ted`, holding floats if approximated.
+    '''
+    if not is_approximated(trees, mode, budget):
+        return pairwise_ted(trees, pairs, backend = backend), False
+
+    n = len(trees)
+
+    if pairs is None:
+        pairs = all_pairs(n)
+    else:
+        pairs = upper_pairs(pairs)
+
+    summaries = [summarise(tree) for tree in trees]
+
+    distances = np.full((n, n), -1, dtype = np.float64)
+
+    for i, j in pairs:
+        distances[i, j] = approximate_ted(summaries[i], summaries[j])
+
+    return distances, True
@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+
+import os
+import gzip
+import zlib
+import random
+import struct
+import shutil
+import tarfile
+import zipfile
+import pytest
+from alpino import open_store, get_records, decode_base64_number, DictzipReader, DirectoryStore, TarStore, ZipStore, CompactStore
+
+#---------------------------------------------------#
+#   Every store must give the same texts, sentences #
+#   and file contents as the Alpino output stored   #
+#   as directories.                                 #
+#---------------------------------------------------#
+
+fixtures = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_fixtures', 'alpino')
+
+# Sample dataset: {text directory: [sentence file names]}
+texts = {
+    'text_0.txt': ['1.xml', '2.xml'],
+    'text_1.txt': ['3.xml', '4.xml'],
+    }
+
+base64_digits = 'ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz0123456789+/'
+
+def encode_base64_number(number):
+    digits = ''
+
+    while True:
+        digits = base64_digits[number % 64] + digits
+        number //= 64
+
+        if not number:
+            return digits
+
+def write_dictzip(path, data, chunk_length = None):
+    '''
+    Writes `data` as a dictzip file compressed in chunks of `chunk_length`
+    bytes, or as a plain gzip file without the 'RA' field if None.
+    '''
+    if chunk_length is None:
+        with gzip.open(path, 'wb') as f:
+            f.write(data)
+        return
+
+    sizes = []
+    compressed = b''
+
+    for start in range(0, len(data), chunk_length):
+        compressor = zlib.compressobj(9, zlib.DEFLATED, -zlib.MAX_WBITS)
+        last = start + chunk_length >= len(data)
+        chunk = compressor.compress(data[start:start + chunk_length]) + compressor.flush(zlib.Z_FINISH if last else zlib.Z_FULL_FLUSH)
+        sizes.append(len(chunk))
+        compressed += chunk
+
+    ra = struct.pack('<HHH', 1, chunk_length, len(sizes)) + struct.pack(f'<{len(sizes)}H', *sizes)
+    extra = b'RA' + struct.pack('<H', len(ra)) + ra
+
+    # FEXTRA and FNAME are set
+    header = b'\x1f\x8b\x08\x0c' + b'\x00' * 4 + b'\x02\x03' + struct.pack('<H', len(extra)) + extra + b'corpus.data\x00'
+
+    with open(path, 'wb') as f:
+        f.write(header + compressed + struct.pack('<II', zlib.crc32(data), len(data) & 0xffffffff))
+
+def write_dataset(directory):
+    '''
+    Writes the sample dataset as directories.
+
+    Returns dict -> {(text, sentence): file content}
+    '''
+    contents = {}
+
+    for text, sentences in texts.items():
+        os.makedirs(os.path.join(directory, text))
+
+        for sentence in sentences:
+            shutil.copy(os.path.join(fixtures, sentence), os.path.join(directory, text, sentence))
+
+            with open(os.path.join(fixtures, sentence), 'rb') as f:
+                contents[(text, sentence)] = f.read()
+
+    return contents
+
+def members(prefix = ''):
+    '''
+    Returns list of tuples -> (member name, fixture path) of the sample dataset.
+    '''
+    return [(f'{prefix}{text}/{sentence}', os.path.join(fixtures, sentence)) for text, sentences in texts.items() for sentence in sentences]
+
+def write_tar(path, named_members, mode = 'w'):
+    with tarfile.open(path, mode) as archive:
+        for name, source in named_members:
+            archive.add(source, arcname = name)
+
+def write_zip(path, named_members):
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as archive:
+        for name, source in named_members:
+            archive.write(source, name)
+
+def write_compact(path, named_members, chunk_length = None):
+    data = b''
+    lines = []
+
+    for name, source in named_members:
+        with open(source, 'rb') as f:
+            content = f.read()
+
+        lines.append(f'{name}\t{encode_base64_number(len(data))}\t{encode_base64_number(len(content))}\n')
+        data += content
+
+    with open(f'{path}.index', 'w', encoding = 'utf-8') as f:
+        f.writelines(lines)
+
+    write_dictzip(f'{path}.data.dz', data, chunk_length)
+
+@pytest.fixture
+def contents(tmp_path):
+    return write_dataset(tmp_path / 'reference')
+
+def assert_store_holds(store, contents):
+    assert sorted(store.texts()) == sorted(texts)
+
+    for text, sentences in texts.items():
+        assert store.sentences(text) == sentences
+
+        for sentence in sentences:
+            read = store.read(text, sentence)
+
+            if not isinstance(read, bytes):
+                with open(read, 'rb') as f:
+                    read = f.read()
+
+            assert read == contents[(text, sentence)]
+
+
+def test_directory_store(tmp_path):
+    contents = write_dataset(tmp_path / 'alpino_output' / 'dataset')
+    store = open_store(str(tmp_path / 'alpino_output' / 'dataset'))
+
+    assert isinstance(store, DirectoryStore)
+    assert_store_holds(store, contents)
+
+@pytest.mark.parametrize('extension, mode', [('.tar', 'w'), ('.tar.gz', 'w:gz'), ('.tar.bz2', 'w:bz2'), ('.tar.xz', 'w:xz')])
+@pytest.mark.parametrize('prefix', ['', 'dataset/'])
+def test_tar_store(tmp_path, contents, extension, mode, prefix):
+    (tmp_path / 'alpino_output').mkdir()
+    write_tar(str(tmp_path / 'alpino_output' / f'dataset{extension}'), members(prefix), mode)
+
+    store = open_store(str(tmp_path / 'alpino_output' / 'dataset'))
+
+    assert isinstance(store, TarStore)
+    assert_store_holds(store, contents)
+
+@pytest.mark.parametrize('prefix', ['', 'dataset/', 'alpino_output/dataset/'])
+def test_zip_store(tmp_path, contents, prefix):
+    (tmp_path / 'alpino_output').mkdir()
+    write_zip(str(tmp_path / 'alpino_output' / 'dataset.zip'), members(prefix))
+
+    store = open_store(str(tmp_path / 'alpino_output' / 'dataset'))
+
+    assert isinstance(store, ZipStore)
+    assert_store_holds(store, contents)
+
+@pytest.mark.parametrize('chunk_length', [None, 64, 500, 58315], ids = ['gzip', '64', '500', 'one chunk'])
+def test_compact_store(tmp_path, contents, chunk_length):
+    (tmp_path / 'alpino_output').mkdir()
+    write_compact(str(tmp_path / 'alpino_output' / 'dataset'), members(), chunk_length)
+
+    store = open_store(str(tmp_path / 'alpino_output' / 'dataset'))
+
+    assert isinstance(store, CompactStore)
+    assert_store_holds(store, contents)
+
+def test_records_are_the_same_in_every_store(tmp_path):
+    write_dataset(tmp_path / 'directory' / 'alpino_output' / 'dataset')
+    (tmp_path / 'archive' / 'alpino_output').mkdir(parents = True)
+    write_tar(str(tmp_path / 'archive' / 'alpino_output' / 'dataset.tar.gz'), members('dataset/'), 'w:gz')
+
+    def comparable(records):
+        return [(sentence, record._replace(tree = record.tree.bracket(), summary = record.summary.signature)) for sentence, record in records]
+
+    for text in texts:
+        expected = comparable(get_records(str(tmp_path / 'directory' / 'alpino_output' / 'dataset' / text)))
+
+        assert comparable(get_records(str(tmp_path / 'archive' / 'alpino_output' / 'dataset' / text))) == expected
+
+
+def test_decode_base64_number():
+    assert decode_base64_number('A') == 0
+    assert decode_base64_number('/') == 63
+    assert decode_base64_number('BA') == 64
+    assert decode_base64_number('Bd9') == 64 * 64 + 29 * 64 + 61
+
+    for number in (1, 63, 64, 4095, 4096, 123456789):
+        assert decode_base64_number(encode_base64_number(number)) == number
+
+@pytest.mark.parametrize('chunk_length', [None, 7, 100])
+def test_dictzip_random_access(tmp_path, chunk_length):
+    rng = random.Random(0)
+    data = bytes(rng.randrange(256) for _ in range(2000))
+    write_dictzip(str(tmp_path / 'data.dz'), data, chunk_length)
+
+    reader = DictzipReader(str(tmp_path / 'data.dz'))
+
+    # Only files without the 'RA' field are decompressed as a whole
+    assert (reader.data is None) == (chunk_length is not None)
+    assert reader.read(0, len(data)) == data
+
+    for _ in range(200):
+        offset = rng.randrange(len(data))
+        size = rng.randrange(len(data) - offset + 1)
+
+        assert reader.read(offset, size) == data[offset:offset + size]
+
+
+def test_archive_of_several_datasets(tmp_path, contents):
+    # The whole alpino_output folder in one archive, with another dataset
+    # whose sentences have the same names
+    other = [(name, os.path.join(fixtures, '1.xml')) for name, source in members('alpino_output/other/')]
+    write_zip(str(tmp_path / 'alpino_output.zip'), other + members('alpino_output/dataset/'))
+
+    store = open_store(str(tmp_path / 'alpino_output' / 'dataset'))
+
+    assert store.strict
+    assert_store_holds(store, contents)
+
+    other_store = open_store(str(tmp_path / 'alpino_output' / 'other'))
+
+    assert other_store.read('text_1.txt', '4.xml') == contents[('text_0.txt', '1.xml')]
+
+    with pytest.raises(FileNotFoundError):
+        open_store(str(tmp_path / 'alpino_output' / 'missing'))
+
+def test_dataset_archive_prefers_its_own_directory(tmp_path, contents):
+    (tmp_path / 'alpino_output').mkdir()
+    other = [(name, os.path.join(fixtures, '1.xml')) for name, source in members('other/')]
+    write_tar(str(tmp_path / 'alpino_output' / 'dataset.tar.gz'), other + members('dataset/'), 'w:gz')
+
+    store = open_store(str(tmp_path / 'alpino_output' / 'dataset'))
+
+    assert not store.strict
+    assert_store_holds(store, contents)
+
+@pytest.mark.parametrize('writer', [write_tar, write_zip, write_compact])
+def test_duplicate_members(tmp_path, writer):
+    # Two datasets, neither under the dataset's own directory
+    (tmp_path / 'alpino_output').mkdir()
+    path = str(tmp_path / 'alpino_output' / 'dataset')
+
+    if writer is write_tar:
+        path += '.tar'
+    elif writer is write_zip:
+        path += '.zip'
+
+    writer(path, members('a/') + members('b/'))
+
+    with pytest.raises(ValueError):
+        open_store(str(tmp_path / 'alpino_output' / 'dataset'))
+
+def test_missing_output(tmp_path):
+    with pytest.raises(FileNotFoundError):
+        open_store(str(tmp_path / 'alpino_output' / 'dataset'))
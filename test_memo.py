@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+
+import random
+import numpy as np
+import pytest
+import ted
+from apted import APTED
+from ted import TedMemo, TreeSummary, pairwise_ted
+from test_ted import random_tree
+
+#---------------------------------------------------#
+#   The TED memo must return the distance of an     #
+#   unordered pair of trees however it was stored:  #
+#   directly, from a file or from a pool worker.    #
+#---------------------------------------------------#
+
+def test_key_is_symmetric():
+    memo = TedMemo()
+    memo.put('b', 'a', 3)
+
+    assert memo.get('a', 'b') == memo.get('b', 'a') == 3
+    assert memo.get('a', 'c') is None
+    assert len(memo) == 1
+    assert (memo.hits, memo.misses) == (2, 1)
+
+def test_least_recently_used_entries_are_evicted():
+    memo = TedMemo(max_entries = 3)
+
+    for i, name in enumerate('abc'):
+        memo.put(name, 'x', i)
+
+    # 'a' is used again, so 'b' is now the least recently used entry
+    assert memo.get('x', 'a') == 0
+
+    memo.put('d', 'x', 3)
+
+    assert len(memo) == 3
+    assert memo.get('b', 'x') is None
+    assert [memo.get(name, 'x') for name in 'acd'] == [0, 2, 3]
+
+def test_save_and_load(tmp_path):
+    path = str(tmp_path / 'memo.json')
+    memo = TedMemo()
+
+    for i in range(10):
+        memo.put(f'tree {i}', f'tree {i + 1}', i)
+
+    memo.save(path)
+
+    loaded = TedMemo()
+    loaded.load(path)
+
+    assert len(loaded) == 10
+    assert all(loaded.get(f'tree {i + 1}', f'tree {i}') == i for i in range(10))
+
+    # Loaded entries are not reported as updates
+    assert loaded.take_updates()[0] == []
+
+    # A missing file leaves the memo empty
+    missing = TedMemo()
+    missing.load(str(tmp_path / 'missing.json'))
+
+    assert len(missing) == 0
+
+def test_save_keeps_the_most_recently_used_entries(tmp_path):
+    path = str(tmp_path / 'memo.json')
+    memo = TedMemo()
+
+    for i in range(5):
+        memo.put('x', str(i), i)
+
+    memo.get('x', '0')
+    memo.save(path)
+
+    loaded = TedMemo(max_entries = 2)
+    loaded.load(path)
+
+    assert loaded.get('x', '0') == 0
+    assert loaded.get('x', '4') == 4
+    assert loaded.get('x', '1') is None
+
+def test_updates_are_merged():
+    worker = TedMemo()
+    worker.put('a', 'b', 1)
+
+    # Nothing is recorded until `record_updates` is set, as in the main process
+    assert worker.take_updates() == ([], 0, 0)
+
+    worker.record_updates = True
+    worker.put('d', 'c', 2)
+    worker.get('a', 'b')
+    worker.get('a', 'e')
+
+    updates = worker.take_updates()
+
+    assert updates == ([('c', 'd', 2)], 1, 1)
+    assert worker.take_updates() == ([], 0, 0)
+
+    main = TedMemo()
+    main.merge(updates)
+
+    assert main.get('c', 'd') == 2
+    assert main.get('a', 'b') is None
+    assert (main.hits, main.misses) == (2, 2)
+
+def test_pairwise_ted_uses_the_memo(monkeypatch):
+    monkeypatch.setattr(ted, 'ted_memo', TedMemo())
+
+    rng = random.Random(0)
+    trees = [random_tree(rng, rng.randint(5, 20)) for _ in range(5)]
+    summaries = [TreeSummary(tree) for tree in trees]
+
+    first = pairwise_ted(summaries, backend = 'apted')
+
+    assert ted.ted_memo.hits == 0
+    assert len(ted.ted_memo) == 10
+
+    for i in range(5):
+        for j in range(i + 1, 5):
+            assert first[i, j] == APTED(trees[i], trees[j]).compute_edit_distance()
+
+    # The same trees, compared again in another order with the other backend
+    second = pairwise_ted(summaries[::-1], backend = 'numpy')
+
+    assert ted.ted_memo.hits == 10
+    assert np.array_equal(np.triu(second[::-1, ::-1].T, 1), np.triu(first, 1))
@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+
+import os
+import pytest
+import xml.etree.ElementTree as ET
+from parsing import read_alpino, visit_sentence, tree_to_brackets, tree_to_apted
+from benchmark import words_before_main_verb_naive
+
+#---------------------------------------------------#
+#   Words before the main verb on sample Alpino     #
+#   output must be counted as by the original       #
+#   loop over every word and every node.            #
+#---------------------------------------------------#
+
+fixtures = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'test_fixtures', 'alpino')
+
+expected_counts = {
+    # A single main clause
+    '1.xml': [1],
+    # Two `smain` conjuncts (rel="cnj"): the count is reset at the second,
+    # and "ik" is repeated
+    '2.xml': [1, 1],
+    # An `smain` under `du` that is not a `dp`: no reset
+    '3.xml': [3],
+    # `smain` and `sv1` discourse parts (rel="dp"), several finite verbs
+    # and repeated words; the `ssub` verb is not a main verb
+    '4.xml': [1, 3],
+    }
+
+def naive_words_before_main_verb(path):
+    '''
+    The count as computed before the nodes were indexed by position, see
+    `benchmark.words_before_main_verb_naive`.
+    '''
+    root = ET.parse(path)
+
+    return words_before_main_verb_naive(root.find('sentence').text.split(' '), list(root.iter('node')))
+
+@pytest.mark.parametrize('name', sorted(expected_counts))
+def test_words_before_main_verb(name):
+    path = os.path.join(fixtures, name)
+
+    expected = naive_words_before_main_verb(path)
+
+    assert expected == expected_counts[name]
+    assert visit_sentence(read_alpino(path)).words_before_main_verb == expected
+
+@pytest.mark.parametrize('name', sorted(expected_counts))
+def test_words_before_main_verb_from_element_tree(name):
+    path = os.path.join(fixtures, name)
+
+    assert visit_sentence(ET.parse(path)).words_before_main_verb == naive_words_before_main_verb(path)
+
+def comparable(record):
+    return record._replace(tree = record.tree.bracket(), summary = record.summary.signature)
+
+@pytest.mark.parametrize('name', sorted(expected_counts))
+def test_read_alpino_sources(name):
+    # A path, a binary file object and bytes give the same sentence
+    path = os.path.join(fixtures, name)
+
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    with open(path, 'rb') as f:
+        from_file = comparable(visit_sentence(read_alpino(f)))
+
+    assert comparable(visit_sentence(read_alpino(path))) == from_file == comparable(visit_sentence(read_alpino(data)))
+    assert comparable(visit_sentence(ET.parse(path))) == from_file
+
+
+# Bracket notation of the sample sentences, as written by the original
+# recursive walker
+expected_brackets = {
+    '1.xml': '{top{smain{su}{hd}{pp{hd}{obj1}}}{--}}',
+    '2.xml': '{top{conj{smain{su}{hd}{pp{hd}{obj1}}}{crd}{smain{su}{hd}{pp{hd}{obj1}}}}{--}}',
+    '3.xml': '{top{du{tag}{smain{su}{hd}{pp{hd}{obj1}}}}{--}{--}}',
+    '4.xml': '{top{du{smain{su}{hd}{obj1}}{sv1{hd}{su}{cp{cmp}{body}}}}{--}}',
+    }
+
+def parse_brackets(brackets):
+    '''
+    Returns tuple -> (labels, parents) of the nodes of a bracket string in
+    preorder, -1 for a root.
+    '''
+    labels = []
+    parents = []
+    open_nodes = []
+    i = 0
+
+    while i < len(brackets):
+        if brackets[i] == '}':
+            open_nodes.pop()
+            i += 1
+            continue
+
+        end = i + 1
+        while brackets[end] not in '{}':
+            end += 1
+
+        parents.append(open_nodes[-1] if open_nodes else -1)
+        open_nodes.append(len(labels))
+        labels.append(brackets[i + 1:end])
+        i = end
+
+    return labels, parents
+
+@pytest.mark.parametrize('name', sorted(expected_brackets))
+def test_tree_to_brackets(name):
+    tree = read_alpino(os.path.join(fixtures, name))
+    brackets = expected_brackets[name]
+
+    assert tree_to_brackets(tree) == brackets
+    assert tree_to_brackets(tree, structure = True) == (brackets, *parse_brackets(brackets))
+    assert tree_to_apted(tree).bracket() == brackets
+    assert visit_sentence(tree).summary.signature == brackets
+
+def deep_tree(depth):
+    '''
+    Returns ElementTree -> a sentence of one word under `depth` nested NPs.
+    '''
+    root = ET.Element('alpino_ds')
+    node = ET.SubElement(root, 'node', begin = '0', cat = 'top', end = '1', rel = 'top')
+
+    for _ in range(depth):
+        node = ET.SubElement(node, 'node', begin = '0', cat = 'np', end = '1', rel = 'mod')
+
+    ET.SubElement(node, 'node', begin = '0', end = '1', lcat = 'np', pos = 'noun', rel = 'hd', word = 'huis')
+    ET.SubElement(root, 'sentence').text = 'huis'
+
+    return ET.ElementTree(root)
+
+def test_deep_tree():
+    # Deeper than Python's recursion limit
+    depth = 1500
+    tree = deep_tree(depth)
+    brackets = '{top' + '{np' * depth + '{hd}' + '}' * (depth + 1)
+
+    assert tree_to_brackets(tree) == brackets
+    assert tree_to_brackets(tree, structure = True) == (brackets, ['top'] + ['np'] * depth + ['hd'], list(range(-1, depth + 1)))
+
+    record = visit_sentence(tree)
+
+    assert record.summary.signature == brackets
+    assert record.summary.size == depth + 2
+    assert (record.n_np, record.n_nodes) == (1, 1)
@@ -0,0 +1,159 @@
+#!/usr/bin/env python3
+
+import sys
+import types
+import regex as re
+import pandas as pd
+import pytest
+import preprocessing
+from preprocessing import check_ner, split_sentences, apply_stanza_preprocessing, html_lines, ModelNotFoundError
+
+#---------------------------------------------------#
+#   The Stanza-based steps must give the same       #
+#   output with a shared annotation as with a fresh #
+#   one. Stanza is replaced by a small stand-in     #
+#   whose tokeniser is case-sensitive, like         #
+#   Stanza's.                                       #
+#---------------------------------------------------#
+
+names = {'Antwerpen', 'Gent', 'Jan'}
+
+class Token:
+    def __init__(self, text, start_char, end_char, ner):
+        self.text = text
+        self.start_char = start_char
+        self.end_char = end_char
+        self.ner = ner
+
+class Sentence:
+    def __init__(self, tokens):
+        self.tokens = tokens
+
+class Document:
+    def __init__(self, sentences, text = None):
+        self.text = text
+        self.sentences = sentences
+
+class Pipeline:
+    '''
+    Splits a text in words and punctuation marks. A sentence ends at a
+    final punctuation mark, or after a lowercase word followed by a
+    capitalized one once it has five tokens. Only the words in `names`
+    are named entities.
+    '''
+
+    def __init__(self, lang, processors, download_method = None, dir = None):
+        self.processors = processors
+        self.n_docs = 0
+        pipelines.append(self)
+
+    def annotate(self, doc):
+        self.n_docs += 1
+
+        tokens = []
+        sentence = []
+        matches = list(re.finditer(r'\w+|[^\w\s]', doc.text))
+
+        for i, match in enumerate(matches):
+            word = match.group()
+            ner = 'S-LOC' if word in names and 'ner' in self.processors else 'O'
+            sentence.append(Token(word, match.start(), match.end(), ner))
+
+            following = matches[i + 1].group() if i + 1 < len(matches) else ''
+
+            if word in '.?!' or (word.islower() and following[:1].isupper() and len(sentence) > 4):
+                tokens.append(sentence)
+                sentence = []
+
+        if sentence:
+            tokens.append(sentence)
+
+        doc.sentences = [Sentence(sentence) for sentence in tokens]
+        return doc
+
+    def __call__(self, doc):
+        if isinstance(doc, str):
+            return self.annotate(Document([], text = doc))
+        return [self.annotate(d) for d in doc]
+
+# Every pipeline loaded by the current test
+pipelines = []
+
+@pytest.fixture(autouse = True)
+def stanza(monkeypatch):
+    module = types.ModuleType('stanza')
+    module.Pipeline = Pipeline
+    module.Document = Document
+
+    monkeypatch.setitem(sys.modules, 'stanza', module)
+    monkeypatch.setattr(preprocessing, 'nlp', None)
+    monkeypatch.setattr(preprocessing, 'tokenizer', None)
+    pipelines.clear()
+
+    return module
+
+def loaded(processors):
+    return [pipeline for pipeline in pipelines if pipeline.processors == processors]
+
+
+def test_check_ner():
+    assert check_ner('Ik woon in Antwerpen en Werk Graag. Mijn Vriend Jan ook.') == 'Ik woon in Antwerpen en werk graag. Mijn vriend Jan ook.'
+
+    # The annotation is only computed when none is given
+    text = 'Ik ga Naar Gent.'
+    doc = preprocessing.get_nlp()(text)
+    n_docs = loaded('tokenize, ner')[0].n_docs
+
+    assert check_ner(text, doc) == 'Ik ga naar Gent.'
+    assert loaded('tokenize, ner')[0].n_docs == n_docs
+    assert check_ner(text) == 'Ik ga naar Gent.'
+    assert loaded('tokenize, ner')[0].n_docs == n_docs + 1
+
+def test_split_sentences():
+    text = 'Ik woon in Gent. ik werk er ook! Morgen ga ik naar huis'
+
+    assert split_sentences(text) == 'Ik woon in Gent. ik werk er ook!\nMorgen ga ik naar huis.\n'
+
+@pytest.mark.parametrize('batch_size', [1, 2, 32])
+def test_apply_stanza_preprocessing(batch_size):
+    texts = [
+        # Unchanged by check_ner
+        'Ik woon in Gent. Ik werk in Antwerpen',
+        # Lowercasing "Werk" adds a sentence boundary before "Gent"
+        'Ik woon in Antwerpen en Werk Gent',
+        'Jan woont in Gent. Hij Is Leraar.',
+        ]
+
+    preprocessed = apply_stanza_preprocessing(texts, batch_size)
+
+    # Every text is annotated once, and only the two texts changed by
+    # `check_ner` are tokenised again, without NER
+    assert loaded('tokenize, ner')[0].n_docs == 3
+    assert loaded('tokenize')[0].n_docs == 2
+
+    # The same as annotating every text again for each step
+    assert preprocessed[1] == 'Ik woon in Antwerpen en werk.\nGent.\n'
+    assert preprocessed == [split_sentences(check_ner(text)) for text in texts]
+
+def test_missing_model(stanza):
+    class MissingModel:
+        def __init__(self, **options):
+            raise FileNotFoundError('nl/tokenize/default.pt')
+
+    stanza.Pipeline = MissingModel
+
+    with pytest.raises(ModelNotFoundError):
+        preprocessing.get_nlp()
+
+
+def test_html_lines_of_duplicate_texts():
+    # The code of every line comes from its own row, also when texts repeat
+    dataset = pd.DataFrame({'TypedText': ['Ik woon in Gent.\nIk werk.', 'Hallo.', 'Ik woon in Gent.\nIk werk.']}, index = [3, 8, 12])
+
+    assert list(html_lines(dataset, '_set2', start = 10)) == [
+        '2010003\tIk woon in Gent.<br>Ik werk.\n',
+        '2011008\tHallo.\n',
+        '2012012\tIk woon in Gent.<br>Ik werk.\n',
+        ]
+
+    assert next(html_lines(dataset, '')).startswith('0000003\t')
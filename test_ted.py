@@ -0,0 +1,191 @@
+#!/usr/bin/env python3
+
+import random
+import pytest
+from apted import APTED
+from apted.helpers import Tree
+from ted import ArrayTree, TreeSummary, array_ted, lower_bound, top_down_distance, approximate_ted, ted_cost, is_approximated, text_ted
+
+#---------------------------------------------------#
+#   The NumPy Zhang-Shasha backend must return the  #
+#   same distances as APTED.                        #
+#---------------------------------------------------#
+
+def apted_distance(tree1, tree2):
+    return APTED(tree1, tree2).compute_edit_distance()
+
+def numpy_distance(tree1, tree2):
+    return array_ted(ArrayTree.from_tree(tree1), ArrayTree.from_tree(tree2))
+
+def path(labels):
+    '''
+    Returns apted.helpers.Tree -> every node is the only child of the previous one.
+    '''
+    tree = Tree(labels[-1])
+
+    for label in reversed(labels[:-1]):
+        tree = Tree(label, tree)
+
+    return tree
+
+def star(root, labels):
+    return Tree(root, *[Tree(label) for label in labels])
+
+def random_tree(rng, n_nodes, labels = 'abcd'):
+    '''
+    Returns apted.helpers.Tree -> random tree with `n_nodes` nodes, built by
+    attaching every node to a random earlier one.
+    '''
+    nodes = [Tree(rng.choice(labels))]
+
+    for _ in range(n_nodes - 1):
+        node = Tree(rng.choice(labels))
+        rng.choice(nodes).children.append(node)
+        nodes.append(node)
+
+    return nodes[0]
+
+
+fixed_pairs = [
+    ('{a}', '{a}', 0),
+    ('{a}', '{b}', 1),
+    ('{a}', '{a{b}}', 1),
+    ('{a{b}{c}}', '{a{c}{b}}', 2),
+    ('{f{d{a}{c{b}}}{e}}', '{f{c{d{a}{b}}}{e}}', 2),
+    ('{top{smain{su}{hd}{obj1}}}', '{top{smain{su}{hd}{obj1}}}', 0),
+    ('{top{smain{su}{hd}{obj1}}}', '{top{du{dp{smain{su}{hd}}}{dp{su}}}}', None),
+    ]
+
+@pytest.mark.parametrize('bracket1, bracket2, distance', fixed_pairs)
+def test_fixed_trees(bracket1, bracket2, distance):
+    tree1 = Tree.from_text(bracket1)
+    tree2 = Tree.from_text(bracket2)
+
+    expected = apted_distance(tree1, tree2)
+
+    if distance is not None:
+        assert expected == distance
+
+    assert numpy_distance(tree1, tree2) == expected
+    assert numpy_distance(tree2, tree1) == expected
+
+
+degenerate_pairs = {
+    'single nodes': (Tree('a'), Tree('a')),
+    'single node and path': (Tree('a'), path(list('abcabcabca'))),
+    'single node and star': (Tree('b'), star('a', 'abcd' * 10)),
+    'path and star': (path(list('abcdabcdabcd')), star('a', list('bcdabcdabcd'))),
+    'paths': (path(list('aabbccdd' * 4)), path(list('abcd' * 7))),
+    'stars': (star('a', 'abab' * 8), star('a', 'baba' * 5)),
+    'identical trees': (random_tree(random.Random(1), 40), random_tree(random.Random(1), 40)),
+    'very different sizes': (random_tree(random.Random(2), 3), random_tree(random.Random(3), 120)),
+    'no shared labels': (random_tree(random.Random(4), 25, 'ab'), random_tree(random.Random(5), 25, 'cd')),
+    }
+
+@pytest.mark.parametrize('name', degenerate_pairs)
+def test_degenerate_trees(name):
+    tree1, tree2 = degenerate_pairs[name]
+
+    expected = apted_distance(tree1, tree2)
+
+    assert numpy_distance(tree1, tree2) == expected
+    assert numpy_distance(tree2, tree1) == expected
+
+def test_identical_trees_have_no_distance():
+    tree = random_tree(random.Random(6), 60)
+
+    assert numpy_distance(tree, tree) == 0
+
+@pytest.mark.parametrize('seed', range(10))
+def test_random_trees(seed):
+    rng = random.Random(seed)
+
+    for _ in range(50):
+        tree1 = random_tree(rng, rng.randint(1, 30))
+        tree2 = random_tree(rng, rng.randint(1, 30))
+
+        assert numpy_distance(tree1, tree2) == apted_distance(tree1, tree2)
+
+def test_layout_is_reused_across_pairs():
+    # The second tree's layout is built once and kept for later pairs
+    rng = random.Random(7)
+    trees = [random_tree(rng, rng.randint(1, 25)) for _ in range(12)]
+    arrays = [ArrayTree.from_tree(tree) for tree in trees]
+
+    for i, tree1 in enumerate(trees):
+        for j, tree2 in enumerate(trees):
+            assert array_ted(arrays[i], arrays[j]) == apted_distance(tree1, tree2)
+
+def test_bracket_round_trip():
+    rng = random.Random(8)
+
+    for _ in range(20):
+        tree = random_tree(rng, rng.randint(1, 30))
+
+        assert ArrayTree.from_tree(tree).bracket() == tree.bracket()
+
+def test_summary_signature():
+    rng = random.Random(9)
+
+    for _ in range(20):
+        tree = random_tree(rng, rng.randint(1, 30))
+
+        assert TreeSummary(tree).signature == TreeSummary(ArrayTree.from_tree(tree)).signature == tree.bracket()
+
+def test_summary_of_deep_tree():
+    # Deeper than Python's recursion limit
+    tree = path(list('ab' * 1000))
+    summary = TreeSummary(tree)
+
+    assert summary.size == 2000
+    assert summary.signature == '{a{b' * 1000 + '}' * 2000
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_bounds(seed):
+    rng = random.Random(seed)
+
+    for _ in range(50):
+        tree1 = random_tree(rng, rng.randint(1, 25))
+        tree2 = random_tree(rng, rng.randint(1, 25))
+        summary1, summary2 = TreeSummary(tree1), TreeSummary(tree2)
+
+        lower = lower_bound(summary1, summary2)
+        upper = top_down_distance(tree1, tree2)
+
+        assert lower <= apted_distance(tree1, tree2) <= upper
+        assert approximate_ted(summary1, summary2) == (lower + upper) / 2
+
+def test_approximate_ted_of_identical_trees():
+    summary1 = TreeSummary(random_tree(random.Random(10), 30))
+    summary2 = TreeSummary(random_tree(random.Random(10), 30))
+
+    assert approximate_ted(summary1, summary2) == 0.0
+
+def test_budget():
+    rng = random.Random(11)
+    trees = [random_tree(rng, rng.randint(1, 20)) for _ in range(4)]
+    summaries = [TreeSummary(tree) for tree in trees]
+    cost = ted_cost(summaries)
+
+    exact, approximated = text_ted(summaries, mode = 'exact', budget = cost)
+
+    assert not approximated
+    assert not is_approximated(summaries, 'exact', cost)
+
+    for i in range(4):
+        for j in range(i + 1, 4):
+            assert exact[i, j] == apted_distance(trees[i], trees[j])
+
+    # One compared node pair too many
+    estimated, approximated = text_ted(summaries, mode = 'exact', budget = cost - 1)
+
+    assert approximated
+    assert is_approximated(summaries, 'exact', cost - 1)
+
+    for i in range(4):
+        for j in range(i + 1, 4):
+            assert estimated[i, j] == approximate_ted(summaries[i], summaries[j])
+
+    assert is_approximated(summaries, 'approximate')
+    assert text_ted(summaries, mode = 'approximate')[1]
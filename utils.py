@@ -21,6 +21,29 @@ def get_n_sentences(text):
     return(len(get_sentences(text)))
 
 
+def pop_option(argv, name, default = None, cast = str):
+    '''
+    Removes the command line option `name` and the value that follows it
+    from the argument list `argv`.
+
+    Returns the option's value converted with `cast`, or `default` if the
+    option was not given.
+    '''
+    if name not in argv:
+        return default
+
+    i = argv.index(name)
+
+    try:
+        value = cast(argv[i + 1])
+    except (IndexError, ValueError):
+        raise SystemExit(f'Option {name} requires a valid value')
+
+    del argv[i:i + 2]
+
+    return value
+
+
 def get_text_n_from_df(name):
     pattern = r'(?<=input\/text_)[0-9]+(?=\.txt)'
     n = re.search(pattern, name).group(0)